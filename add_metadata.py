@@ -1,17 +1,60 @@
 import re
 import os
 import json
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from metadata_store import MetadataStore
+
+
+# Number of characters copied at a time from a text file to its document.
+COPY_CHUNK = 1 << 16
 
 
 class AddMetadata:
-    def __init__(self, input_directory, output_directory):
+    def __init__(self, input_directory, output_directory, metadata_store=None, report=None,
+                 high_throughput=False, threads=1, progress_interval=10000):
         self.input_directory = input_directory.rstrip(os.sep)
         self.output_directory = output_directory.rstrip(os.sep)
+        # Shared with Converter2vertical when both run in the same process.
+        self.metadata_store = metadata_store or MetadataStore()
+        # Optional RunReport receiving the time spent on each file.
+        self.report = report
+        # In high-throughput mode, the documents are streamed to temporary files without per-file
+        # messages, optionally by a pool of threads; progress is printed every progress_interval files.
+        self.high_throughput = high_throughput
+        self.threads = threads
+        self.progress_interval = progress_interval
+        self.created_directories = set()
+        # The counters and the report are shared by the threads; the metadata store has its own lock.
+        self.lock = threading.Lock()
+        self.progress = {'written': 0, 'skipped': 0, 'no_metadata': 0}
+
+    def __getstate__(self):
+        # Locks cannot be pickled, and fused converters carry an AddMetadata to their worker processes.
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
 
-    def process_articles(self):
+    def process_articles(self, index=None):
+        if index is not None:
+            self.process_index(index)
+            return
+        self.process_files(self.walk_files())
+
+    def walk_files(self):
+        # Yields the text file, metadata file and output file of every review of the input tree.
         reviewed_articles_dir = os.path.join(self.input_directory, 'reviewed_articles')
 
         for root, dirs, files in os.walk(reviewed_articles_dir):
+            output_dir_path = None
             for filename in files:
                 # I'm only working with .txt files here
                 if filename.endswith('.txt'):
@@ -22,12 +65,140 @@ class AddMetadata:
                     txt_file_path = os.path.join(root, filename)
                     json_file_path = os.path.join(root, f'{base_name}.json')
 
-                    relative_path = os.path.relpath(root, self.input_directory)
-                    output_dir_path = os.path.join(self.output_directory, relative_path)
-                    os.makedirs(output_dir_path, exist_ok=True)
+                    if output_dir_path is None:
+                        relative_path = os.path.relpath(root, self.input_directory)
+                        output_dir_path = os.path.join(self.output_directory, relative_path)
+                        self.make_directory(output_dir_path)
                     output_file_path = os.path.join(output_dir_path, filename)
 
-                    self.process_single_file(txt_file_path, json_file_path, output_file_path)
+                    yield txt_file_path, json_file_path, output_file_path
+
+    def process_index(self, index):
+        # Same as process_articles, but the files come from a CorpusIndex of the input directory
+        # instead of a new walk of the tree.
+        self.process_files(self.index_files(index))
+
+    def index_files(self, index):
+        for entry in index.entries:
+            if entry.extension != '.txt':
+                continue
+            base_name = os.path.splitext(entry.path)[0]
+            if self.is_supplement_file(os.path.basename(base_name)):
+                continue
+
+            json_file_path = entry.metadata_path or f'{base_name}.json'
+            relative_path = os.path.relpath(entry.path, self.input_directory)
+            output_file_path = os.path.join(self.output_directory, relative_path)
+            self.make_directory(os.path.dirname(output_file_path))
+
+            yield entry.path, json_file_path, output_file_path
+
+    def make_directory(self, path):
+        # Each output directory is created once, instead of once per file.
+        if path not in self.created_directories:
+            os.makedirs(path, exist_ok=True)
+            self.created_directories.add(path)
+
+    def process_files(self, files):
+        """
+        Writes the document of each file.
+
+        Args:
+            files (iterable): The text file, metadata file and output file of each document.
+
+        Returns:
+            None
+        """
+        if not self.high_throughput:
+            for txt_file_path, json_file_path, output_file_path in files:
+                self.process_single_file(txt_file_path, json_file_path, output_file_path)
+            return
+        self.progress = {'written': 0, 'skipped': 0, 'no_metadata': 0}
+        self.started = time.perf_counter()
+        if self.threads <= 1:
+            for txt_file_path, json_file_path, output_file_path in files:
+                self.stream_single_file(txt_file_path, json_file_path, output_file_path)
+        else:
+            with ThreadPoolExecutor(self.threads) as executor:
+                files = iter(files)
+                # Submitted in batches, so that the pending futures do not hold the whole corpus.
+                while True:
+                    batch = list(islice(files, self.threads * 64))
+                    if not batch:
+                        break
+                    for _ in executor.map(lambda paths: self.stream_single_file(*paths), batch):
+                        pass
+        self.print_progress(final=True)
+
+    def stream_single_file(self, txt_file_path, json_file_path, output_file_path):
+        """
+        Writes the document of a file in high-throughput mode, with the same content as process_single_file.
+
+        The header, the text and the footer are copied to a temporary file chunk by chunk, and the
+        temporary file replaces the output once complete, so that an undecodable or missing text
+        file leaves no output behind, as in process_single_file.
+
+        Args:
+            txt_file_path (str): The text file.
+            json_file_path (str): The metadata file.
+            output_file_path (str): The document to write.
+
+        Returns:
+            bool: True if the document was written, False if the file was skipped.
+        """
+        start = time.perf_counter()
+        attributes_str = self.load_attributes(json_file_path)
+        metadata_seconds = time.perf_counter() - start
+        if attributes_str is None:
+            attributes_str = ''
+            self.count('no_metadata')
+
+        start = time.perf_counter()
+        temp_path = output_file_path + '.part'
+        try:
+            with open(txt_file_path, 'r', encoding='utf-8') as text_file, \
+                    open(temp_path, 'w', encoding='utf-8') as output_file:
+                output_file.write(f'<doc {attributes_str}>\n')
+                shutil.copyfileobj(text_file, output_file, COPY_CHUNK)
+                output_file.write('\n</doc>')
+            os.replace(temp_path, output_file_path)
+        except BaseException as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if not isinstance(e, (UnicodeDecodeError, FileNotFoundError)):
+                raise
+            self.count('skipped')
+            return False
+        if self.report is not None:
+            with self.lock:
+                self.report.add_file(txt_file_path, '.txt', os.path.getsize(txt_file_path),
+                                     {'metadata': metadata_seconds, 'write': time.perf_counter() - start})
+        self.count('written')
+        return True
+
+    def load_attributes(self, file_path):
+        # read_attributes without its messages; missing and undecodable files count as no metadata.
+        try:
+            return self.metadata_store.render(file_path, self.metadata_to_attributes)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def count(self, name):
+        with self.lock:
+            self.progress[name] += 1
+            done = self.progress['written'] + self.progress['skipped']
+        if name != 'no_metadata' and done % self.progress_interval == 0:
+            self.print_progress()
+
+    def print_progress(self, final=False):
+        progress = dict(self.progress)
+        done = progress['written'] + progress['skipped']
+        elapsed = time.perf_counter() - self.started
+        rate = done / elapsed if elapsed else 0.0
+        print(f'{"Done: " if final else ""}{progress["written"]} documents written, {progress["skipped"]} '
+              f'text files skipped, {progress["no_metadata"]} without metadata ({rate:.0f} files/s).')
+        if final and self.report is not None:
+            self.report.count('skipped', progress['skipped'])
 
     def is_supplement_file(self, file_name):
         # Assuming all files with an 's' before the digit are supplementary files
@@ -37,23 +208,32 @@ class AddMetadata:
             return False
 
     def process_single_file(self, txt_file_path, json_file_path, output_file_path):
+        start = time.perf_counter()
         text_content = self.read_text_file(txt_file_path)
+        read_seconds = time.perf_counter() - start
         if text_content is None:
             print(f'{txt_file_path} is empty. Skipping file.')
+            if self.report is not None:
+                self.report.count('skipped')
             return
 
-        metadata = self.read_json_file(json_file_path)
-        if metadata is None:
+        start = time.perf_counter()
+        attributes_str = self.read_attributes(json_file_path)
+        if attributes_str is None:
             print(f'{json_file_path} does not contain metadata.')
             attributes_str = ''
-        else:
-            attributes_str = self.metadata_to_attributes(metadata)
+        metadata_seconds = time.perf_counter() - start
 
+        start = time.perf_counter()
         doc_tags = f'<doc {attributes_str}>\n{text_content}\n</doc>'
 
         with open(output_file_path, 'w', encoding='utf-8') as output_file:
             output_file.write(doc_tags)
         print(f'Metadata added: {output_file_path}')
+        if self.report is not None:
+            self.report.add_file(txt_file_path, '.txt', len(text_content),
+                                 {'read': read_seconds, 'metadata': metadata_seconds,
+                                  'write': time.perf_counter() - start})
 
     def read_text_file(self, file_path):
         try:
@@ -70,10 +250,9 @@ class AddMetadata:
 
     def read_json_file(self, file_path):
         try:
-            with open(file_path, 'r', encoding='utf-8') as json_file:
-                data = json.load(json_file)
-                print(f'Read metadata from: {file_path}.')
-                return data
+            data = self.metadata_store.load(file_path)
+            print(f'Read metadata from: {file_path}.')
+            return data
         except FileNotFoundError:
             print(f'JSON file not found: {file_path}')
             return None
@@ -81,6 +260,12 @@ class AddMetadata:
             print(f'Error decoding JSON file {file_path}: {e}')
             return None
 
+    def read_attributes(self, file_path):
+        # The attributes are rendered once per JSON file by the metadata store.
+        if self.read_json_file(file_path) is None:
+            return None
+        return self.metadata_store.render(file_path, self.metadata_to_attributes)
+
     def metadata_to_attributes(self, metadata):
         attributes = []
         for key, value in metadata.items():
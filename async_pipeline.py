@@ -0,0 +1,225 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from corpus_index import CorpusIndex
+from functions2txt import _convert_in_worker, _init_worker, _render_in_worker, temp_output_path
+from shards import encode_document
+
+
+# Bytes of the files read ahead of the workers, and size above which a file is not read ahead:
+# its worker converts it from its path, in constant memory for the streaming formats.
+PREFETCH_BYTES = 256 * 1024 ** 2
+LARGE_FILE = 32 * 1024 ** 2
+
+
+class ByteBudget:
+    def __init__(self, limit):
+        """
+        Bounds the bytes held by the tasks. A task asking for more than the limit waits until it is alone.
+
+        Args:
+            limit (int): The number of bytes.
+
+        Returns:
+            None
+        """
+        self.limit = limit
+        self.used = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.used or self.used + size <= self.limit)
+            self.used += size
+
+    async def release(self, size):
+        async with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+class AsyncConverter:
+    def __init__(self, converter, prefetch=None, io_threads=8, writers=4, write_queue=32,
+                 prefetch_bytes=PREFETCH_BYTES, large_file=LARGE_FILE):
+        """
+        Runs a Converter2vertical with asyncio, overlapping disk I/O with the extraction.
+
+        Source files are read ahead by a thread pool, headers are rendered from the metadata
+        store in their own thread, the extraction and tokenization run in a process pool and the
+        documents are written by a few writer tasks through a bounded queue. Files larger than
+        large_file are not read ahead: their worker converts them from their path, as
+        iterate_through_corpus does.
+
+        Args:
+            converter (Converter2vertical): The configured converter; its workers, fused,
+                incremental, cache, shard, scheduler, dedup and report settings are used.
+            prefetch (int): The number of files read ahead of the workers. By default, four per
+                worker.
+            io_threads (int): The number of threads reading and writing files.
+            writers (int): The number of writer tasks.
+            write_queue (int): The number of converted documents waiting to be written.
+            prefetch_bytes (int): The number of bytes of the files read ahead of the workers.
+            large_file (int): The size in bytes above which a file is converted from its path.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the converter has a timeout or memory limit, which need the worker
+                processes of a Supervisor.
+        """
+        if converter.timeout is not None or converter.memory_limit is not None:
+            raise ValueError('AsyncConverter does not support timeout or memory_limit: '
+                             'use Converter2vertical.iterate_through_corpus')
+        self.converter = converter
+        self.prefetch = prefetch or converter.workers * 4
+        self.io_threads = io_threads
+        self.writers = writers
+        self.write_queue = write_queue
+        self.prefetch_bytes = prefetch_bytes
+        self.large_file = large_file
+
+    def run(self, jobs=None):
+        """
+        Converts the corpus, or the given files, like Converter2vertical.iterate_through_corpus.
+
+        Args:
+            jobs (list): The CorpusEntry of the files to convert. By default, the whole corpus.
+
+        Returns:
+            None
+        """
+        converter = self.converter
+        if jobs is None:
+            if converter.index is None:
+                with converter.stage('scan'):
+                    converter.index = CorpusIndex.scan(converter.inpath, converter.extensions)
+            jobs = converter.index.entries
+            if converter.manifest is not None:
+                converter.manifest.prune({converter.manifest_key(job) for job in jobs}, converter.outpath)
+        jobs = converter.pending_jobs(jobs)
+        converter.duplicates = {}
+        converter.dedup_saved = 0.0
+        if converter.dedup:
+            with converter.stage('dedup'):
+                jobs = converter.deduplicate(jobs)
+            duplicates = sum(len(followers) for followers in converter.duplicates.values())
+        if converter.scheduler is not None:
+            # Large files are read and converted first; the makespan is not reported here.
+            jobs, _ = converter.scheduler.order(jobs)
+        asyncio.run(self.convert_all(jobs))
+        if converter.manifest is not None:
+            converter.manifest.save()
+        if converter.dedup:
+            # The duplicates are written by collect_results once their original is written.
+            converter.report_dedup(duplicates)
+
+    async def convert_all(self, jobs):
+        in_flight = asyncio.Semaphore(self.prefetch)
+        self.budget = ByteBudget(self.prefetch_bytes)
+        queue = asyncio.Queue(self.write_queue)
+        with ThreadPoolExecutor(self.io_threads) as io_pool, \
+                ThreadPoolExecutor(1) as metadata_pool, \
+                ProcessPoolExecutor(self.converter.workers, initializer=_init_worker,
+                                    initargs=(self.converter,)) as cpu_pool:
+            pools = io_pool, metadata_pool, cpu_pool
+            writers = [asyncio.create_task(self.write(queue, io_pool)) for _ in range(self.writers)]
+            tasks = set()
+            for job in jobs:
+                # Bounds the number of files read but not yet written.
+                await in_flight.acquire()
+                task = asyncio.create_task(self.convert(job, pools, queue, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+            for _ in writers:
+                await queue.put(None)
+            await asyncio.gather(*writers)
+
+    async def convert(self, job, pools, queue, in_flight):
+        io_pool, metadata_pool, cpu_pool = pools
+        loop = asyncio.get_running_loop()
+        converter = self.converter
+        result = {'error': None, 'entry': None, 'timings': {}, 'bytes': 0}
+        header = body = None
+        size = 0
+        try:
+            start = time.perf_counter()
+            file_size = await loop.run_in_executor(io_pool, os.path.getsize, job.path)
+            if file_size > self.large_file:
+                # Converted and written by convert_job in the worker; only the result comes back.
+                converted = await loop.run_in_executor(cpu_pool, _convert_in_worker, job)
+                converter.collect_results([(job, converted)])
+                in_flight.release()
+                return
+            size = file_size
+            await self.budget.acquire(size)
+            data = await loop.run_in_executor(io_pool, read_bytes, job.path)
+            result['bytes'] = len(data)
+            if converter.manifest is not None:
+                result['entry'] = await loop.run_in_executor(io_pool, converter.manifest.describe, job.path,
+                                                             job.metadata_path, converter.manifest_key(job))
+            result['timings']['read'] = time.perf_counter() - start
+            start = time.perf_counter()
+            # Headers are rendered in a single thread of their own, off the event loop.
+            header = await loop.run_in_executor(metadata_pool, converter.document_header, job)
+            result['timings']['metadata'] = time.perf_counter() - start
+            rendered = await loop.run_in_executor(cpu_pool, _render_in_worker, job, data)
+            del data
+            await self.budget.release(size)
+            size = 0
+            result['timings'].update(rendered['timings'])
+            result['error'] = rendered['error']
+            body = rendered['body']
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        if size:
+            await self.budget.release(size)
+        await queue.put((job, header, body, result))
+        in_flight.release()
+
+    async def write(self, queue, io_pool):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            job, header, body, result = item
+            if result['error'] is None and self.converter.shard_writer is not None:
+                # Written to the shards by collect_results; zlib and zstd release the GIL while compressing.
+                start = time.perf_counter()
+                result['document'] = await loop.run_in_executor(io_pool, encode_document, header + body,
+                                                                 self.converter.shard_compression)
+                result['timings']['compress'] = time.perf_counter() - start
+            elif result['error'] is None:
+                start = time.perf_counter()
+                try:
+                    await loop.run_in_executor(io_pool, write_document, self.converter.output_path(job),
+                                               header, body)
+                except OSError as e:
+                    result['error'] = f'{type(e).__name__}: {e}'
+                result['timings']['write'] = result['timings'].get('write', 0) + time.perf_counter() - start
+            if result['error'] is not None:
+                result['entry'] = None
+            self.converter.collect_results([(job, result)])
+
+
+def read_bytes(path):
+    with open(path, 'rb') as infile:
+        return infile.read()
+
+
+def write_document(output_path, header, body):
+    # Same atomic write as Converter2vertical.convert_file.
+    temp_path = temp_output_path(output_path)
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as outfile:
+            outfile.write(header)
+            outfile.write(body)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,243 @@
+# Benchmarks the extractors, the tokenizer and the metadata renderers.
+# Usage:
+# python benchmark.py [--scale N] [--output results.json] [--baseline baseline.json] [--threshold 0.2]
+#
+# Every stage runs in its own process, so that its peak RSS is measured separately and a crashing
+# extractor only fails its own stage. With --baseline, the exit code is 1 when the throughput of a
+# stage dropped by more than the threshold.
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from add_metadata import AddMetadata
+from functions2txt import Converter2vertical
+from tokenizer import TOKEN_PATTERN
+
+EXTRACTOR_STAGES = {'pdf2txt': '.pdf', 'doc2txt': '.doc', 'docx_2txt': '.docx', 'xml2txt': '.xml'}
+TEXT_STAGES = ['txt2vertical', 'write_vertical']
+METADATA_STAGES = ['json_to_sgml', 'metadata_to_attributes']
+
+
+def synthetic_metadata(authors):
+    """
+    Builds metadata shaped like a consortium paper, with a long list of authors.
+
+    Args:
+        authors (int): The number of authors.
+
+    Returns:
+        dict: The metadata.
+    """
+    return {'title': 'Synthetic "benchmark" article & review',
+            'journal': 'Benchmark journal', 'year': '2030', 'doi': '10.5555/12345678',
+            'authors': [{'name': f'Author {number}', 'affiliation': f'University {number % 50}'}
+                        for number in range(authors)],
+            'keywords': [f'keyword {number}' for number in range(20)]}
+
+
+def synthetic_text(input_dir, scale):
+    """
+    Builds a text by repeating the text of the xml fixtures and a filler paragraph.
+
+    Args:
+        input_dir (str): The directory of the fixtures.
+        scale (int): The number of repetitions.
+
+    Returns:
+        str: The text.
+    """
+    converter = make_converter()
+    texts = [converter.xml2txt(os.path.join(input_dir, name))
+             for name in sorted(os.listdir(input_dir)) if name.endswith('.xml')]
+    texts.append('The reviewers, in their 2nd report (see Fig. 3b), asked for a p-value < 0.05; '
+                 'the authors — rightly — refused.\n' * 200)
+    return '\n'.join(texts) * scale
+
+
+def make_converter():
+    # The constructor copies the input tree to the output: give it empty temporary directories.
+    directory = tempfile.mkdtemp()
+    os.makedirs(os.path.join(directory, 'in'))
+    converter = Converter2vertical(os.path.join(directory, 'in') + '/', os.path.join(directory, 'out') + '/')
+    shutil.rmtree(directory)
+    return converter
+
+
+def run_stage(stage, input_dir, scale):
+    """
+    Runs one stage and measures it.
+
+    Args:
+        stage (str): The name of the stage.
+        input_dir (str): The directory of the fixtures.
+        scale (int): How much the fixtures are scaled up.
+
+    Returns:
+        dict: The number of files, bytes and tokens processed and the elapsed seconds.
+    """
+    converter = make_converter()
+    files = processed_bytes = tokens = 0
+    if stage in EXTRACTOR_STAGES:
+        paths = [os.path.join(input_dir, name) for name in sorted(os.listdir(input_dir))
+                 if name.endswith(EXTRACTOR_STAGES[stage])]
+        extractor = getattr(converter, stage)
+        start = time.perf_counter()
+        for _ in range(scale):
+            for path in paths:
+                with open(path, 'rb') as infile:
+                    text = extractor(infile)
+                files += 1
+                processed_bytes += os.path.getsize(path)
+                tokens += len(TOKEN_PATTERN.findall(text or ''))
+        elapsed = time.perf_counter() - start
+    elif stage in TEXT_STAGES:
+        text = synthetic_text(input_dir, scale)
+        start = time.perf_counter()
+        if stage == 'txt2vertical':
+            vertical = converter.txt2vertical(text)
+        else:
+            output = io.StringIO()
+            converter.write_vertical(text, output)
+            vertical = output.getvalue()
+        elapsed = time.perf_counter() - start
+        files = 1
+        processed_bytes = len(text.encode('utf-8'))
+        tokens = vertical.count('\n')
+    else:
+        documents = [synthetic_metadata(100 * scale)]
+        for name in sorted(os.listdir(input_dir)):
+            if name.endswith('.json'):
+                with open(os.path.join(input_dir, name), 'r', encoding='utf-8') as json_file:
+                    documents.append(json.load(json_file))
+        documents = documents * 10
+        renderer = AddMetadata(input_dir, input_dir).metadata_to_attributes
+        start = time.perf_counter()
+        for document in documents:
+            if stage == 'json_to_sgml':
+                header = converter.metadata_to_sgml(document)
+            else:
+                header = renderer(document)
+            processed_bytes += len(header.encode('utf-8'))
+        elapsed = time.perf_counter() - start
+        files = len(documents)
+    return {'files': files, 'bytes': processed_bytes, 'tokens': tokens, 'seconds': elapsed}
+
+
+def _stage_process(connection, stage, input_dir, scale, repeat):
+    try:
+        runs = [run_stage(stage, input_dir, scale) for _ in range(repeat)]
+        result = min(runs, key=lambda run: run['seconds'])
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux.
+            result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        connection.send(result)
+    except Exception as e:
+        connection.send({'error': f'{type(e).__name__}: {e}'})
+
+
+def measure(stage, input_dir, scale, repeat):
+    """
+    Runs a stage in a new process and computes its throughput.
+
+    Args:
+        stage (str): The name of the stage.
+        input_dir (str): The directory of the fixtures.
+        scale (int): How much the fixtures are scaled up.
+        repeat (int): The number of runs; the fastest is kept.
+
+    Returns:
+        dict: The measures of the stage, or the error that stopped it.
+    """
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_stage_process,
+                                      args=(child_connection, stage, input_dir, scale, repeat))
+    process.start()
+    child_connection.close()
+    try:
+        result = connection.recv()
+    except EOFError:
+        result = {'error': 'Stage process died'}
+    process.join()
+    if 'error' in result:
+        return result
+    seconds = max(result['seconds'], 1e-9)
+    result['files_per_s'] = result['files'] / seconds
+    result['mb_per_s'] = result['bytes'] / seconds / 1024 ** 2
+    result['tokens_per_s'] = result['tokens'] / seconds
+    return result
+
+
+def compare(results, baseline, threshold):
+    """
+    Lists the stages whose throughput regressed against a baseline.
+
+    Args:
+        results (dict): The measures of the current run, by stage.
+        baseline (dict): The measures of the baseline run, by stage.
+        threshold (float): The tolerated relative drop of throughput, e.g. 0.2 for 20%.
+
+    Returns:
+        list: A description of each regression.
+    """
+    regressions = []
+    for stage, result in results.items():
+        reference = baseline.get(stage)
+        if reference is None or 'error' in reference:
+            continue
+        if 'error' in result:
+            regressions.append(f'{stage}: {result["error"]}')
+            continue
+        for measure_name in ('files_per_s', 'mb_per_s', 'tokens_per_s'):
+            if reference[measure_name] and result[measure_name] < reference[measure_name] * (1 - threshold):
+                regressions.append(f'{stage}: {measure_name} {result[measure_name]:.1f} < '
+                                   f'{reference[measure_name]:.1f} (baseline)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the conversion stages.')
+    parser.add_argument('--input-dir', default='input_dir', help='The directory of the fixtures.')
+    parser.add_argument('--scale', type=int, default=1, help='How much the fixtures are scaled up.')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of runs of each stage.')
+    parser.add_argument('--stages', nargs='+', default=list(EXTRACTOR_STAGES) + TEXT_STAGES + METADATA_STAGES)
+    parser.add_argument('--output', help='The JSON file the results are written to.')
+    parser.add_argument('--baseline', help='A JSON file of results to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='The tolerated throughput drop.')
+    args = parser.parse_args()
+
+    results = {}
+    for stage in args.stages:
+        results[stage] = result = measure(stage, args.input_dir, args.scale, args.repeat)
+        if 'error' in result:
+            print(f'{stage:>24}: {result["error"]}')
+        else:
+            print(f'{stage:>24}: {result["files_per_s"]:10.1f} files/s {result["mb_per_s"]:10.2f} MB/s '
+                  f'{result["tokens_per_s"]:12.0f} tokens/s {result.get("peak_rss_mb", 0):8.1f} MB peak RSS')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
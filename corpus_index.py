@@ -0,0 +1,132 @@
+import json
+import os
+from collections import namedtuple
+
+# One convertible file of the corpus. metadata_path is None when the file has no metadata JSON.
+CorpusEntry = namedtuple('CorpusEntry', ['article', 'path', 'extension', 'metadata_path', 'supplement'])
+
+
+def is_supplement(file_name):
+    """
+    Tells whether a file is supplementary material, i.e. named "<name>.sN.<ext>".
+
+    Args:
+        file_name (str): The name or path of the file.
+
+    Returns:
+        bool: True for supplementary files.
+    """
+    last_part = os.path.splitext(file_name)[0].split('.')[-1]
+    return last_part.startswith('s') and last_part[1:].isdigit()
+
+
+def metadata_name(file_name):
+    """
+    Returns the metadata JSON file that belongs to a file of the corpus.
+
+    Supplementary files "<name>.sN.<ext>" use the metadata of the review "<name>.rN.json".
+
+    Args:
+        file_name (str): The name or path of the file.
+
+    Returns:
+        str: The name or path of the JSON file.
+    """
+    # Extract the file name without extension
+    review_name, _ = os.path.splitext(file_name)
+
+    # Check if the file name contains "s" followed by an integer
+    parts = review_name.split(".")
+    if parts[-1].startswith("s") and parts[-1][1:].isdigit():
+        # Replace "s" with "r" and append the metadata extension
+        return ".".join(parts[:-1]) + ".r" + parts[-1][1:] + '.json'
+    # If there is no "s" in the file name, just append the metadata extension
+    return review_name + '.json'
+
+
+class CorpusIndex:
+    def __init__(self, inpath, entries):
+        """
+        In-memory list of the files of a corpus, built by a single walk of its directories.
+
+        Args:
+            inpath (str): The path to the corpus, containing the "reviewed_articles" folder.
+            entries (list): The CorpusEntry of every file.
+
+        Returns:
+            None
+        """
+        self.inpath = inpath
+        self.entries = entries
+
+    @classmethod
+    def scan(cls, inpath, extensions):
+        """
+        Lists the files of every "reviewed_articles/*/sub-articles" directory.
+
+        Each directory is listed once with os.scandir; metadata files are looked up in that
+        listing instead of being opened or stat-ed.
+
+        Args:
+            inpath (str): The path to the corpus, containing the "reviewed_articles" folder.
+            extensions (list): The extensions of the files to index, in processing order.
+
+        Returns:
+            CorpusIndex: The index of the corpus.
+        """
+        entries = []
+        with os.scandir(inpath + 'reviewed_articles/') as articles:
+            article_names = sorted(article.name for article in articles if article.is_dir())
+        for article in article_names:
+            entries.extend(cls.scan_directory(inpath, 'reviewed_articles/' + article + '/sub-articles',
+                                              extensions))
+        return cls(inpath, entries)
+
+    @staticmethod
+    def scan_directory(inpath, directory_path, extensions):
+        """
+        Lists the files of one directory of the corpus.
+
+        Args:
+            inpath (str): The path to the corpus.
+            directory_path (str): The path to the directory, relative to the corpus.
+            extensions (list): The extensions of the files to index, in processing order.
+
+        Returns:
+            list: The CorpusEntry of the files, grouped by extension in the order of extensions.
+        """
+        try:
+            with os.scandir(inpath + directory_path) as directory:
+                names = [entry.name for entry in directory if entry.is_file() and not entry.name.startswith('.')]
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        listing = set(names)
+        article = directory_path.split('/')[1] if directory_path.startswith('reviewed_articles/') else directory_path
+        order = {extension: position for position, extension in enumerate(extensions)}
+        entries = []
+        for name in sorted(names):
+            extension = os.path.splitext(name)[1]
+            if extension not in order:
+                continue
+            json_name = metadata_name(name)
+            json_path = inpath + directory_path + '/' + json_name if json_name in listing else None
+            entries.append(CorpusEntry(article, inpath + directory_path + '/' + name, extension, json_path,
+                                       is_supplement(name)))
+        entries.sort(key=lambda entry: order[entry.extension])
+        return entries
+
+    def articles(self):
+        """
+        Returns the names of the indexed articles, in index order.
+        """
+        return list(dict.fromkeys(entry.article for entry in self.entries))
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as index_file:
+            json.dump({'inpath': self.inpath, 'entries': [list(entry) for entry in self.entries]}, index_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as index_file:
+            data = json.load(index_file)
+        return cls(data['inpath'], [CorpusEntry(*entry) for entry in data['entries']])
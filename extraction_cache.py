@@ -0,0 +1,117 @@
+import gzip
+import os
+
+
+class ExtractionCache:
+    def __init__(self, directory, max_bytes=10 * 1024 ** 3):
+        """
+        On-disk cache of the raw text extracted from source files.
+
+        Texts are stored gzip-compressed, one file per source content hash and extractor
+        version, so the same source is never extracted twice by the same extractor. When the
+        cache grows over max_bytes, the least recently used texts are removed.
+
+        Args:
+            directory (str): The directory holding the cache.
+            max_bytes (int): The maximum size of the compressed texts.
+
+        Returns:
+            None
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Computed on the first write, so that read-only use does not walk the cache.
+        self.size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, source_hash, extractor, version):
+        return os.path.join(self.directory, source_hash[:2], f'{source_hash}.{extractor}.{version}.txt.gz')
+
+    def get(self, source_hash, extractor, version):
+        """
+        Returns a cached text.
+
+        Args:
+            source_hash (str): The SHA-256 of the source file.
+            extractor (str): The name of the extractor.
+            version (str): The version of the extractor.
+
+        Returns:
+            str or None: The extracted text, None if it is not cached.
+        """
+        path = self.path(source_hash, extractor, version)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8', newline='') as cached_file:
+                text = cached_file.read()
+        except (EOFError, OSError):
+            return None
+        # The modification time tells prune which texts were used last.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return text
+
+    def put(self, source_hash, extractor, version, text):
+        """
+        Stores an extracted text.
+
+        Args:
+            source_hash (str): The SHA-256 of the source file.
+            extractor (str): The name of the extractor.
+            version (str): The version of the extractor.
+            text (str): The extracted text.
+
+        Returns:
+            None
+        """
+        path = self.path(source_hash, extractor, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Several workers may store the same text: each writes its own file and renames it.
+        temp_path = f'{path}.{os.getpid()}.part'
+        with gzip.open(temp_path, 'wt', encoding='utf-8', newline='') as cached_file:
+            cached_file.write(text)
+        os.replace(temp_path, path)
+        if self.size is None:
+            self.size = self.disk_usage()
+        else:
+            self.size += os.path.getsize(path)
+        if self.size > self.max_bytes:
+            self.prune()
+
+    def files(self):
+        for root, dirs, files in os.walk(self.directory):
+            for filename in files:
+                if filename.endswith('.txt.gz'):
+                    yield os.path.join(root, filename)
+
+    def disk_usage(self):
+        return sum(os.path.getsize(path) for path in self.files())
+
+    def prune(self, target=0.9):
+        """
+        Removes the least recently used texts until the cache uses less than target * max_bytes.
+
+        Args:
+            target (float): The fraction of max_bytes to go back to, leaving room for new texts.
+
+        Returns:
+            None
+        """
+        entries = []
+        for path in self.files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
@@ -1,57 +1,225 @@
+import codecs
+import cProfile
+import glob
+import hashlib
+import io
+import mmap
 import os
 import shutil
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from fnmatch import fnmatch
+from functools import lru_cache
 
-import docx2txt
-import glob
 import json
-import aspose.words as aw
-import re
-from pdfminer.high_level import extract_text
 import xml.etree.ElementTree as ET
-from metadata import json_to_sgml
+from metadata import render_sgml
+from manifest import MANIFEST_NAME, ConversionManifest, file_sha256
+from corpus_index import CorpusIndex
+from metadata_store import MetadataStore
+from add_metadata import AddMetadata
+from extraction_cache import ExtractionCache
+from supervisor import Supervisor
+from shards import ShardWriter, decode_document, encode_document
+from tokenizer import CHUNK_SIZE, Tokenizer
+from work_queue import Heartbeat, worker_name
+
+# The extractors of pdf, doc and docx files are imported by their method, when the first file
+# of their type is converted: aspose.words alone costs every process seconds and hundreds of MB.
+
+# Bump when a change of the converters changes their output, so that incremental runs
+# convert everything again.
+CONVERTER_VERSION = '2'
+
+QUARANTINE_NAME = 'quarantine.json'
+
+# The extractors whose output is worth caching, with the package doing the extraction: a new
+# version of the package invalidates the cached texts.
+CACHED_EXTRACTORS = {'.pdf': 'pdfminer.six', '.doc': 'aspose-words', '.docx': 'docx2txt'}
+# Bump the version of an extractor when a change of its method changes the extracted text. The
+# cache does not depend on CONVERTER_VERSION, so that tokenizer changes keep the cached texts.
+EXTRACTOR_VERSIONS = {'.pdf': '1', '.doc': '1', '.docx': '1'}
+
+# Converter instance of the current pool worker, set once by _init_worker so that
+# the converter is not pickled again for every job.
+_worker_converter = None
+
+
+@lru_cache(maxsize=None)
+def extractor_version(extension):
+    from importlib import metadata as importlib_metadata
+
+    package = CACHED_EXTRACTORS[extension]
+    try:
+        return f'{package}-{importlib_metadata.version(package)}-{EXTRACTOR_VERSIONS[extension]}'
+    except importlib_metadata.PackageNotFoundError:
+        return f'{package}-unknown-{EXTRACTOR_VERSIONS[extension]}'
+
+
+def temp_output_path(output_path):
+    # Unique per writer: a queue worker that lost its lease and the new owner of the job may
+    # write the same output at the same time.
+    return f'{output_path}.{worker_name()}.part'
+
+
+def source_sha256(path):
+    # The hash of a source, or None if it cannot be read: such files are never deduplicated.
+    try:
+        return file_sha256(path)
+    except OSError:
+        return None
+
+
+def _init_worker(converter):
+    global _worker_converter
+    _worker_converter = converter
+
+
+def _convert_in_worker(job):
+    return _worker_converter.convert_job(job)
+
+
+def _render_in_worker(job, data):
+    return _worker_converter.render_body(job, data)
 
 
 class Converter2vertical:
-    def __init__(self, inpath, outpath):
+    def __init__(self, inpath, outpath, workers=1, incremental=False, index=None, metadata_store=None,
+                 fused=False, cache_dir=None, cache_size=10 * 1024 ** 3, timeout=None, memory_limit=None,
+                 retries=1, report=None, profile_dir=None, profile_pattern='*', shard_size=None,
+                 shard_compression=None, columns=None, work_queue=None, scheduler=None, dedup=False):
         """
         Initializes an instance of the class with the specified input and output paths.
 
         Args:
             inpath (str): The path to the input directory.
             outpath (str): The path to the output directory.
+            workers (int): Number of processes used to convert files. None uses all cores.
+            incremental (bool): Keep the existing output and only convert the files whose source,
+                metadata or converter version changed since the last run.
+            index (CorpusIndex): A previously saved index of the input directory. By default,
+                iterate_through_corpus scans the input directory.
+            metadata_store (MetadataStore): The cache of metadata JSON files, which can be shared
+                with AddMetadata. By default, a new one is created.
+            fused (bool): Write the final SketchEngine documents directly, with the "doc" attributes
+                of AddMetadata, instead of the intermediate tree that AddMetadata reads back.
+            cache_dir (str): A directory where the text extracted from pdf, doc and docx files is
+                cached, so that later runs with another tokenizer or metadata skip the extraction.
+            cache_size (int): The maximum size of the cache in bytes.
+            timeout (float): The wall-clock limit of the conversion of one file in seconds. When a
+                timeout or a memory limit is set, files are converted in supervised worker
+                processes, which are killed and replaced when a file hangs or crashes them.
+            memory_limit (int): The memory limit of a worker process in bytes.
+            retries (int): How many times a file is converted again after a timeout or crash,
+                before it is put in quarantine.
+            report (RunReport): Collects the duration of each stage and of each file of the run.
+            profile_dir (str): A directory where a cProfile dump of each converted file matching
+                profile_pattern is written.
+            profile_pattern (str): The fnmatch pattern of the paths of the files to profile.
+            shard_size (int): If set, the documents are concatenated into vertical files of about
+                this many bytes in the output directory, with an index of their offsets, instead
+                of one output file per source file. Cannot be used in incremental mode.
+            shard_compression (str): The compression of the shards: None, 'gz' or 'zst'. Every
+                document is compressed on its own, so that it can be read back from its offset.
+            columns (list): The functions computing extra columns of the vertical format, such as
+                tokenizer.lowercase_column.
+            work_queue (WorkQueue): Makes the converter the coordinator or a worker of a shared
+                queue: the output directory is kept, enqueue adds the articles of the corpus to
+                the queue and work converts the queued articles.
+            scheduler (Scheduler): Starts the files with the largest expected cost first, learns
+                the throughput of each format and reports the predicted and actual makespan.
+            dedup (bool): Hash the sources before converting them and convert files with the same
+                content and extension once: the other outputs get their own header and a copy of
+                the tokens.
 
         Returns:
             None
         """
         self.inpath = inpath
         self.outpath = outpath
+        self.workers = workers or os.cpu_count()
+        self.failures = {}
+        self.manifest = None
+        self.index = index
+        self.metadata_store = metadata_store or MetadataStore()
+        self.fused = fused
+        self.attribute_renderer = AddMetadata(inpath, outpath, self.metadata_store) if fused else None
+        self.extraction_cache = ExtractionCache(cache_dir, cache_size) if cache_dir is not None else None
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.retries = retries
+        self.quarantine = {}
+        self.report = report
+        self.profile_dir = profile_dir
+        self.profile_pattern = profile_pattern
+        self.shard_size = shard_size
+        self.shard_compression = shard_compression
+        self.shard_writer = None
+        self.tokenizer = Tokenizer(columns)
+        self.work_queue = work_queue
+        # The process pool or Supervisor kept by run_jobs between runs, see keep_workers.
+        self.executor = None
+        self.supervisor = None
+        self.scheduler = scheduler
+        self.dedup = dedup
+        # Duplicates of the files of the current run, by path of the file that is converted.
+        self.duplicates = {}
+        self.dedup_saved = 0.0
         self.extensions = ['.docx', '.doc', '.xml', '.pdf', '.txt']
         self.extensions_dict = {'.docx': self.docx_2txt,
                                 '.doc': self.doc2txt,
-                                '.xml': self.xml2txt,
-                                '.pdf': self.pdf2txt, '.txt': lambda x: x.read()}
+                                '.xml': self.iter_xml_text,
+                                '.pdf': self.pdf2txt, '.txt': self.txt2txt}
 
         def ignore_files(directory, files):
             return [f for f in files if os.path.isfile(os.path.join(directory, f))]
 
         # calling the shutil.copytree() method and passing the src,dst,and ignore parameter
-        if os.path.exists(self.outpath):
-            shutil.rmtree(self.outpath)
-        shutil.copytree(self.inpath, self.outpath, ignore=ignore_files)
+        if work_queue is not None:
+            # The output directory is shared by the coordinator and the workers of every host, and
+            # holds the outputs of the jobs already done: it is never removed.
+            if incremental or shard_size is not None:
+                raise ValueError('Queue workers cannot use incremental mode or sharded output')
+            shutil.copytree(self.inpath, self.outpath, ignore=ignore_files, dirs_exist_ok=True)
+        elif shard_size is not None:
+            if incremental:
+                raise ValueError('Sharded output cannot be used in incremental mode')
+            if os.path.exists(self.outpath):
+                shutil.rmtree(self.outpath)
+            self.shard_writer = ShardWriter(self.outpath, shard_size, shard_compression)
+        elif incremental:
+            shutil.copytree(self.inpath, self.outpath, ignore=ignore_files, dirs_exist_ok=True)
+            version = CONVERTER_VERSION + '-fused' if fused else CONVERTER_VERSION
+            # The columns change every output as well.
+            version += ''.join(f'-{column.__qualname__}' for column in self.tokenizer.columns)
+            self.manifest = ConversionManifest(os.path.join(self.outpath, MANIFEST_NAME), version)
+            self.quarantine = self.load_quarantine()
+        else:
+            if os.path.exists(self.outpath):
+                shutil.rmtree(self.outpath)
+            shutil.copytree(self.inpath, self.outpath, ignore=ignore_files)
 
     def iterate_through_corpus(self):
         """
         Iterates through the corpus by iterating over each directory in the "reviewed_articles" folder.
-        If a directory has a "sub-articles" subdirectory, it calls the "all2txt" method with the
-        path to the "sub-articles" subdirectory.
+        The files of every "sub-articles" subdirectory are taken from the corpus index and converted
+        together, so that a parallel run can spread the whole corpus over the workers.
+        In incremental mode, the outputs of files that left the corpus are removed.
         Parameters:
         self (object): The instance of the class.
         Returns:
         None
         """
-        for directory in os.listdir(self.inpath + 'reviewed_articles/'):
-            if os.path.isdir(self.inpath + 'reviewed_articles/' + directory + '/sub-articles'):
-                self.all2txt('reviewed_articles/' + directory + '/sub-articles')
+        if self.index is None:
+            with self.stage('scan'):
+                self.index = CorpusIndex.scan(self.inpath, self.extensions)
+        jobs = self.index.entries
+        if self.manifest is not None:
+            with self.stage('manifest'):
+                self.manifest.prune({self.manifest_key(job) for job in jobs}, self.outpath)
+        self.run_jobs(jobs)
 
     def all2txt(self, directory_path):
         """
@@ -63,33 +231,605 @@ class Converter2vertical:
         Returns:
             None
         """
-        for extension in self.extensions:
-            directory = glob.glob(self.inpath + directory_path + '/*' + extension)
-            for file_name in directory:
-                with open(self.outpath + file_name[len(self.inpath):-len(extension)] + '.txt', 'w',
-                          encoding='utf-8') as outfile:
-                    # Extract the file name without extension
-                    review_name, _ = os.path.splitext(file_name)
-
-                    # Check if the file name contains "s" followed by an integer
-                    parts = review_name.split(".")
-                    if parts[-1].startswith("s") and parts[-1][1:].isdigit():
-                        # Replace "s" with "r" and append the metadata extension
-                        metadata_name = ".".join(parts[:-1]) + ".r" + parts[-1][1:] + '.json'
-                    else:
-                        # If there is no "s" in the file name, just append the metadata extension
-                        metadata_name = review_name + '.json'
-                    doc_tag = self.add_metadata(metadata_name)
-
-                    # PROBLEM WITH SUPPLEMENTARY MATERIALS
-                    if doc_tag is not None:
-                        outfile.write(doc_tag)
-                    with open(file_name, 'rb') as infile:
-                        # print('Converting '+file_name)
-                        doc = self.extensions_dict[extension](infile)
-                        if doc is not None:
-                            doc = self.txt2vertical(doc)
-                            outfile.write(doc)
+        with self.stage('scan'):
+            jobs = CorpusIndex.scan_directory(self.inpath, directory_path, self.extensions)
+        self.run_jobs(jobs)
+
+    def enqueue(self):
+        """
+        Coordinator mode: adds a job per article of the corpus to the work queue of the converter.
+
+        Articles that are already queued are left as they are, so the coordinator can be run
+        again to queue the articles added to the corpus since.
+
+        Returns:
+            int: The number of articles added to the queue.
+
+        Raises:
+            ValueError: If the converter has no work queue. Without one, the constructor replaces
+                the output directory, and with it the outputs of the jobs already done.
+        """
+        if self.work_queue is None:
+            raise ValueError('Create the coordinator with work_queue, so that the output directory is kept')
+        if self.index is None:
+            with self.stage('scan'):
+                self.index = CorpusIndex.scan(self.inpath, self.extensions)
+        entries = self.index.entries
+        if self.scheduler is not None:
+            # Articles are claimed in queue order: the most expensive ones are queued first.
+            article_costs = {}
+            for entry in entries:
+                article_costs[entry.article] = article_costs.get(entry.article, 0.0) + self.scheduler.estimate(entry)
+            entries = sorted(entries, key=lambda entry: -article_costs[entry.article])
+        added = self.work_queue.enqueue(self.inpath, entries)
+        print(f'Queued {added} articles.')
+        return added
+
+    def work(self, owner=None, wait=True, poll_interval=5):
+        """
+        Worker mode: converts the articles of the work queue until none is left.
+
+        Each article is converted by run_jobs while a heartbeat renews its lease, then marked
+        done with its failed files. An error of the worker gives the article back to the queue.
+
+        Args:
+            owner (str): The name of the worker. By default, the host name and process id.
+            wait (bool): Keep polling while other workers hold leases, so that the articles of
+                a worker that dies are converted again once its leases expire.
+            poll_interval (float): The seconds between two polls.
+
+        Returns:
+            int: The number of articles converted by this worker.
+        """
+        owner = owner or worker_name()
+        converted = 0
+        # The articles are small: the same worker processes convert all of them.
+        with self.keep_workers():
+            while True:
+                claimed = self.work_queue.claim(owner, self.inpath)
+                if claimed is None:
+                    if wait and self.work_queue.counts().get('leased'):
+                        time.sleep(poll_interval)
+                        continue
+                    return converted
+                job_id, jobs = claimed
+                try:
+                    with Heartbeat(self.work_queue, job_id, owner) as heartbeat:
+                        self.run_jobs(jobs)
+                except Exception as e:
+                    print(f'Error while converting queued job {job_id}: {e}')
+                    self.work_queue.release(job_id, owner, f'{type(e).__name__}: {e}')
+                    continue
+                failures = {job.path: self.failures[job.path] for job in jobs if job.path in self.failures}
+                if heartbeat.lost or not self.work_queue.complete(job_id, owner, failures):
+                    print(f'Lost the lease of queued job {job_id}: it is left to another worker.')
+                else:
+                    converted += 1
+
+    def run_jobs(self, jobs):
+        """
+        Converts a list of files, in a process pool when more than one worker is configured.
+
+        Every output file is written by exactly one job, so the output does not depend on the
+        number of workers. Failed files are recorded in self.failures instead of stopping the run.
+        In incremental mode, the files whose output is up to date are skipped and the manifest
+        is saved regularly, so that an interrupted run resumes where it stopped.
+        In fused mode, supplementary files are skipped, as AddMetadata does.
+        With a timeout or memory limit, the files are converted under a Supervisor and the files
+        that hang or crash their worker are recorded in the quarantine file of the output
+        directory; incremental runs skip them until their content changes.
+        With a scheduler, the files are started longest first and handed one at a time to the
+        free workers. With dedup, only one of the files with the same content is converted.
+
+        Args:
+            jobs (list): The CorpusEntry of the files to convert.
+
+        Returns:
+            None
+        """
+        jobs = self.pending_jobs(jobs)
+        self.duplicates = {}
+        self.dedup_saved = 0.0
+        if self.dedup:
+            with self.stage('dedup'):
+                jobs = self.deduplicate(jobs)
+            duplicates = sum(len(followers) for followers in self.duplicates.values())
+        if self.scheduler is not None:
+            jobs, costs = self.scheduler.order(jobs)
+            start = time.perf_counter()
+        if self.timeout is not None or self.memory_limit is not None:
+            supervisor = self.supervisor or Supervisor(_convert_in_worker, self.workers, self.timeout,
+                                                       self.memory_limit, self.retries, _init_worker, (self,))
+            for job, result, error in supervisor.run(jobs):
+                if error is not None:
+                    # Its duplicates would hang or crash the same way in the next runs.
+                    for quarantined_job in [job] + self.duplicates.get(job.path, []):
+                        self.add_to_quarantine(quarantined_job, error)
+                    result = {'error': error, 'entry': None, 'timings': {}, 'bytes': 0}
+                self.collect_results([(job, result)])
+            self.save_quarantine()
+        elif self.workers > 1 and len(jobs) > 1:
+            # Large chunks keep the files of one directory on the same worker. Scheduled jobs are
+            # handed one at a time, so that the free workers take the next largest file.
+            chunksize = max(1, len(jobs) // (self.workers * 4)) if self.scheduler is None else 1
+            executor = self.executor or ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                            initargs=(self,))
+            with executor if self.executor is None else nullcontext():
+                self.collect_results(zip(jobs, executor.map(_convert_in_worker, jobs, chunksize=chunksize)))
+        else:
+            self.collect_results(zip(jobs, map(self.convert_job, jobs)))
+        if self.manifest is not None:
+            with self.stage('manifest'):
+                self.manifest.save()
+        if self.shard_writer is not None:
+            self.shard_writer.flush()
+        if self.scheduler is not None and jobs:
+            self.record_schedule(costs, time.perf_counter() - start, len(jobs))
+        if self.dedup:
+            self.report_dedup(duplicates)
+
+    def report_dedup(self, duplicates):
+        print(f'Copied {duplicates} duplicate files instead of converting them, '
+              f'saving about {self.dedup_saved:.1f} s.')
+        if self.report is not None:
+            self.report.count('deduplicated', duplicates)
+            self.report.count('dedup_saved_seconds', self.dedup_saved)
+
+    def record_schedule(self, costs, elapsed, jobs_count):
+        # The sequential path converts on a single worker.
+        supervised = self.timeout is not None or self.memory_limit is not None
+        parallel = supervised or (self.workers > 1 and jobs_count > 1)
+        workers = min(self.workers, jobs_count) if parallel else 1
+        run = self.scheduler.record_run(self.scheduler.predict_makespan(costs, workers), elapsed, workers)
+        print(f'Predicted makespan {run["predicted_makespan"]:.1f} s, actual {run["actual_makespan"]:.1f} s, '
+              f'{run["balance"]:.0%} of the workers\' time spent converting.')
+        if self.report is not None:
+            self.report.schedule = run
+
+    def close(self):
+        # Closes the shards and their index; the output is already complete after each run.
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+
+    def __getstate__(self):
+        # Worker processes return their documents: only the parent writes the shards.
+        state = self.__dict__.copy()
+        state['shard_writer'] = None
+        state['executor'] = None
+        state['supervisor'] = None
+        return state
+
+    @contextmanager
+    def keep_workers(self):
+        """
+        Keeps the worker processes of run_jobs alive between its calls, instead of starting new
+        ones for every run, which also imports the extractors again in each of them.
+
+        Returns:
+            contextmanager: The worker processes are stopped at its exit.
+        """
+        if self.timeout is not None or self.memory_limit is not None:
+            self.supervisor = Supervisor(_convert_in_worker, self.workers, self.timeout, self.memory_limit,
+                                         self.retries, _init_worker, (self,))
+            workers = self.supervisor
+        elif self.workers > 1:
+            self.executor = workers = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                          initargs=(self,))
+        else:
+            workers = nullcontext()
+        try:
+            with workers:
+                yield
+        finally:
+            self.executor = None
+            self.supervisor = None
+
+    def pending_jobs(self, jobs):
+        """
+        Leaves out the files that the run does not need to convert.
+
+        Args:
+            jobs (list): The CorpusEntry of the files.
+
+        Returns:
+            list: The files to convert.
+        """
+        if self.fused:
+            jobs = [job for job in jobs if not self.attribute_renderer.is_supplement_file(
+                os.path.splitext(os.path.basename(job.path))[0])]
+        if self.manifest is not None:
+            with self.stage('manifest'):
+                pending = [job for job in jobs if not self.is_current(job) and not self.is_quarantined(job)]
+            print(f'Skipping {len(jobs) - len(pending)} unchanged or quarantined files.')
+            if self.report is not None:
+                self.report.count('skipped', len(jobs) - len(pending))
+            jobs = pending
+        return jobs
+
+    def collect_results(self, results):
+        for job, result in results:
+            if self.scheduler is not None and result['error'] is None:
+                self.scheduler.observe(job.extension, result['bytes'], sum(result['timings'].values()))
+            if self.report is not None:
+                self.report.add_file(job.path, job.extension, result['bytes'], result['timings'])
+            if result['error'] is not None:
+                # Duplicates would fail the same way.
+                for failed_job in [job] + self.duplicates.pop(job.path, []):
+                    print(f'Error while converting {failed_job.path}: {result["error"]}')
+                    self.failures[failed_job.path] = result['error']
+                    if self.report is not None:
+                        self.report.count('failed')
+            else:
+                if job.path in self.duplicates:
+                    self.fan_out(job, result)
+                if self.shard_writer is not None:
+                    with self.stage('shard'):
+                        self.shard_writer.add_encoded(self.manifest_key(job), result.pop('document'))
+                if self.manifest is not None:
+                    self.manifest.record(self.manifest_key(job), result['entry'])
+
+    def deduplicate(self, jobs):
+        """
+        Keeps the first of the files that have the same content and extension.
+
+        The others are recorded in self.duplicates, to be written by fan_out once the kept file
+        is converted.
+
+        Args:
+            jobs (list): The CorpusEntry of the files.
+
+        Returns:
+            list: The files to convert.
+        """
+        # Hashing is I/O bound and hashlib releases the GIL: threads are enough.
+        with ThreadPoolExecutor(self.workers) as executor:
+            hashes = list(executor.map(source_sha256, [job.path for job in jobs]))
+        kept = {}
+        unique = []
+        for job, source_hash in zip(jobs, hashes):
+            first = kept.setdefault((source_hash, job.extension), job) if source_hash is not None else job
+            if first is job:
+                unique.append(job)
+            else:
+                self.duplicates.setdefault(first.path, []).append(job)
+        return unique
+
+    def fan_out(self, job, result):
+        """
+        Writes the outputs of the duplicates of a converted file: their own header, then its tokens.
+
+        Args:
+            job (CorpusEntry): The converted file.
+            result (dict): The result of its conversion.
+
+        Returns:
+            None
+        """
+        start = time.perf_counter()
+        header_length = len(self.document_header(job))
+        duplicates = self.duplicates.pop(job.path)
+        if self.shard_writer is not None:
+            body = decode_document(result['document'], self.shard_compression)[header_length:]
+        for duplicate in duplicates:
+            try:
+                entry = None
+                if self.manifest is not None:
+                    entry = self.manifest.describe(duplicate.path, duplicate.metadata_path,
+                                                   self.manifest_key(duplicate))
+                if self.shard_writer is not None:
+                    self.shard_writer.add(self.manifest_key(duplicate), self.document_header(duplicate) + body)
+                else:
+                    self.copy_output(job, duplicate, header_length)
+                if self.manifest is not None:
+                    self.manifest.record(self.manifest_key(duplicate), entry)
+            except Exception as e:
+                print(f'Error while converting {duplicate.path}: {e}')
+                self.failures[duplicate.path] = f'{type(e).__name__}: {e}'
+        converted = sum(seconds for name, seconds in result['timings'].items() if name not in ('hash', 'metadata'))
+        self.dedup_saved += converted * len(duplicates) - (time.perf_counter() - start)
+
+    def copy_output(self, job, duplicate, header_length):
+        # Same atomic write as convert_file; newline='' keeps the characters of the header countable.
+        output_path = self.output_path(duplicate)
+        temp_path = temp_output_path(output_path)
+        try:
+            with open(self.output_path(job), 'r', encoding='utf-8', newline='') as infile, \
+                    open(temp_path, 'w', encoding='utf-8', newline='') as outfile:
+                outfile.write(self.document_header(duplicate))
+                infile.read(header_length)
+                shutil.copyfileobj(infile, outfile)
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def stage(self, name):
+        # Times a stage of the run in the report, if there is one.
+        return self.report.stage(name) if self.report is not None else nullcontext()
+
+    def load_quarantine(self):
+        try:
+            with open(os.path.join(self.outpath, QUARANTINE_NAME), 'r', encoding='utf-8') as quarantine_file:
+                return json.load(quarantine_file)
+        except FileNotFoundError:
+            return {}
+
+    def save_quarantine(self):
+        quarantine_path = os.path.join(self.outpath, QUARANTINE_NAME)
+        if not self.quarantine:
+            if os.path.exists(quarantine_path):
+                os.remove(quarantine_path)
+            return
+        with open(quarantine_path, 'w', encoding='utf-8') as quarantine_file:
+            json.dump(self.quarantine, quarantine_file, indent=1, sort_keys=True)
+
+    def add_to_quarantine(self, job, reason):
+        # A killed worker of this host may have left its temporary output behind.
+        pattern = f'{glob.escape(self.output_path(job))}.{glob.escape(socket.gethostname())}-*.part'
+        for temp_path in glob.glob(pattern):
+            os.remove(temp_path)
+        self.quarantine[job.path] = {'reason': reason, 'sha256': file_sha256(job.path)}
+
+    def is_quarantined(self, job):
+        entry = self.quarantine.get(job.path)
+        if entry is None:
+            return False
+        if os.path.exists(job.path) and file_sha256(job.path) == entry['sha256']:
+            return True
+        # The file changed: give it another chance.
+        del self.quarantine[job.path]
+        return False
+
+    def convert_job(self, job):
+        """
+        Converts a single file, catching any error so that one file cannot stop the run.
+
+        Args:
+            job (CorpusEntry): The file to convert.
+
+        Returns:
+            dict: The error message or None, the manifest entry of the output in incremental mode,
+            the seconds spent in each stage and the size of the file. With sharded output, the
+            document is returned encoded for the shards as "document" instead of being written.
+        """
+        result = {'error': None, 'entry': None, 'timings': {}, 'bytes': 0}
+        try:
+            result['bytes'] = os.path.getsize(job.path)
+            if self.manifest is not None:
+                # Fingerprint the sources before converting: a change during the conversion
+                # must be seen by the next run.
+                start = time.perf_counter()
+                result['entry'] = self.manifest.describe(job.path, job.metadata_path, self.manifest_key(job))
+                result['timings']['hash'] = time.perf_counter() - start
+            source_hash = result['entry']['source']['sha256'] if result['entry'] is not None else None
+            convert = self.render_document if self.shard_size is not None else self.convert_file
+            if self.profile_dir is not None and fnmatch(job.path, self.profile_pattern):
+                profiler = cProfile.Profile()
+                document = profiler.runcall(convert, job, source_hash, result['timings'])
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, self.manifest_key(job).replace(os.sep, '__')
+                                                 + '.prof'))
+            else:
+                document = convert(job, source_hash, result['timings'])
+            if self.shard_size is not None:
+                # Compressed here, in the worker, so that the parent only appends bytes to the shards.
+                start = time.perf_counter()
+                result['document'] = encode_document(document, self.shard_compression)
+                result['timings']['compress'] = time.perf_counter() - start
+        except Exception as e:
+            # Under a memory limit, the Supervisor puts the file in quarantine instead of failing it
+            # again on every run.
+            if isinstance(e, MemoryError) and self.memory_limit is not None:
+                raise
+            result['error'] = f'{type(e).__name__}: {e}'
+            result['entry'] = None
+        return result
+
+    def output_path(self, job):
+        return self.outpath + job.path[len(self.inpath):-len(job.extension)] + '.txt'
+
+    def manifest_key(self, job):
+        return os.path.relpath(self.output_path(job), self.outpath)
+
+    def is_current(self, job):
+        return self.manifest.is_current(self.manifest_key(job), self.output_path(job),
+                                        job.path, job.metadata_path)
+
+    def convert_file(self, job, source_hash=None, timings=None):
+        """
+        Converts a single file and writes its vertical text next to the other outputs.
+
+        The output is written to a temporary file first, so that a failed conversion never
+        leaves a truncated .txt behind. In fused mode, the document is written in the final
+        format of AddMetadata: "<doc attributes>", the tokens and "</doc>".
+
+        Args:
+            job (CorpusEntry): The file to convert.
+            source_hash (str): The SHA-256 of the file, if it is already known.
+            timings (dict): If given, receives the seconds spent on the metadata, the extraction
+                and the tokenization and writing of the file.
+
+        Returns:
+            None
+        """
+        if timings is None:
+            timings = {}
+        output_path = self.output_path(job)
+        temp_path = temp_output_path(output_path)
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as outfile:
+                start = time.perf_counter()
+                outfile.write(self.document_header(job))
+                timings['metadata'] = time.perf_counter() - start
+                with open(job.path, 'rb') as infile:
+                    # print('Converting '+file_name)
+                    self.write_body(job, infile, outfile, source_hash, timings)
+                start = time.perf_counter()
+            os.replace(temp_path, output_path)
+            timings['write'] += time.perf_counter() - start
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def render_document(self, job, source_hash=None, timings=None):
+        """
+        Converts a single file in memory, for sharded output.
+
+        Args:
+            job (CorpusEntry): The file to convert.
+            source_hash (str): The SHA-256 of the file, if it is already known.
+            timings (dict): If given, receives the seconds spent on each stage.
+
+        Returns:
+            str: The document, as convert_file would write it.
+        """
+        if timings is None:
+            timings = {}
+        document = io.StringIO()
+        start = time.perf_counter()
+        document.write(self.document_header(job))
+        timings['metadata'] = time.perf_counter() - start
+        with open(job.path, 'rb') as infile:
+            self.write_body(job, infile, document, source_hash, timings)
+        return document.getvalue()
+
+    def document_header(self, job):
+        """
+        Returns what is written before the tokens of a file: its "doc" element.
+
+        Args:
+            job (CorpusEntry): The converted file.
+
+        Returns:
+            str: The header, empty if the file has no metadata outside of fused mode.
+        """
+        if self.fused:
+            return f'<doc {self.doc_attributes(job)}>\n'
+        # The index only knows the metadata files that exist.
+        doc_tag = self.add_metadata(job.metadata_path) if job.metadata_path is not None else None
+
+        # PROBLEM WITH SUPPLEMENTARY MATERIALS
+        return doc_tag if doc_tag is not None else ''
+
+    def write_body(self, job, infile, outfile, source_hash=None, timings=None):
+        """
+        Extracts the text of a file and writes its tokens.
+
+        Args:
+            job (CorpusEntry): The converted file.
+            infile (file): The binary file object of the file.
+            outfile (file): The text file object to write to.
+            source_hash (str): The SHA-256 of the file, if it is already known.
+            timings (dict): If given, receives the seconds spent on extraction and writing.
+
+        Returns:
+            None
+        """
+        if timings is None:
+            timings = {}
+        start = time.perf_counter()
+        doc = self.extract(job, infile, source_hash)
+        timings['extract'] = time.perf_counter() - start
+        start = time.perf_counter()
+        if self.fused:
+            # The doc element is always closed, even if the extraction failed.
+            self.write_vertical(doc if doc is not None else '', outfile, closing='</doc>')
+        elif doc is not None:
+            self.write_vertical(doc, outfile)
+        timings['write'] = time.perf_counter() - start
+
+    def render_body(self, job, data):
+        """
+        Converts a file whose content was already read, without touching the disk.
+
+        Args:
+            job (CorpusEntry): The converted file.
+            data (bytes): The content of the file.
+
+        Returns:
+            dict: The rendered tokens as "body", the error message or None, and the timings.
+        """
+        result = {'body': None, 'error': None, 'timings': {}}
+        try:
+            source_hash = hashlib.sha256(data).hexdigest() if self.extraction_cache is not None else None
+            body = io.StringIO()
+            self.write_body(job, io.BytesIO(data), body, source_hash, result['timings'])
+            result['body'] = body.getvalue()
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        return result
+
+    def extract(self, job, infile, source_hash=None):
+        """
+        Extracts the text of a file, through the extraction cache for pdf, doc and docx files.
+
+        Args:
+            job (CorpusEntry): The file to extract.
+            infile (file): The binary file object of the file.
+            source_hash (str): The SHA-256 of the file, if it is already known.
+
+        Returns:
+            The output of the extractor of the file extension.
+        """
+        extractor = self.extensions_dict[job.extension]
+        if self.extraction_cache is None or job.extension not in CACHED_EXTRACTORS:
+            return extractor(infile)
+        if source_hash is None:
+            source_hash = file_sha256(job.path)
+        version = extractor_version(job.extension)
+        text = self.extraction_cache.get(source_hash, extractor.__name__, version)
+        if text is None:
+            text = extractor(infile)
+            # Failed extractions are not cached: they are tried again on the next run.
+            if text is not None:
+                self.extraction_cache.put(source_hash, extractor.__name__, version, text)
+        return text
+
+    def doc_attributes(self, job):
+        """
+        Returns the "doc" attributes of a file in fused mode, as AddMetadata renders them.
+
+        Args:
+            job (CorpusEntry): The converted file.
+
+        Returns:
+            str: The attributes, empty if the file has no metadata.
+        """
+        json_path = job.metadata_path or os.path.splitext(job.path)[0] + '.json'
+        attributes = self.attribute_renderer.read_attributes(json_path)
+        if attributes is None:
+            print(f'{json_path} does not contain metadata.')
+            return ''
+        return attributes
+
+    def txt2txt(self, file, chunk_size=CHUNK_SIZE):
+        """
+        Decodes a txt file as UTF-8, chunk by chunk.
+
+        The file is memory-mapped when possible, so that large files are decoded without being
+        read into memory. Invalid bytes are replaced and a byte order mark is dropped.
+
+        Parameters:
+            file (file): The binary file object of the txt file.
+            chunk_size (int): The number of bytes decoded at a time.
+
+        Returns:
+            generator: The text of the file, in pieces.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, io.UnsupportedOperation):
+            # In-memory files have no descriptor, and empty files cannot be mapped.
+            mapped = None
+        if mapped is None:
+            for block in iter(lambda: file.read(chunk_size), b''):
+                yield decoder.decode(block)
+        else:
+            with mapped, memoryview(mapped) as data:
+                for start in range(0, len(data), chunk_size):
+                    yield decoder.decode(data[start:start + chunk_size])
+        yield decoder.decode(b'', final=True)
 
     def doc2txt(self, file):
         """
@@ -101,6 +841,8 @@ class Converter2vertical:
         Returns:
             str: The text content of the converted txt file.
         """
+        import aspose.words as aw
+
         doc_text = aw.Document(file)
         text = doc_text.get_text().splitlines()
         clean_text = '\n'.join(text[1:-4])
@@ -117,6 +859,8 @@ class Converter2vertical:
             str or None: The extracted text from the PDF file if conversion is successful,
             None if there is an error while converting.
         """
+        from pdfminer.high_level import extract_text
+
         try:
             return extract_text(file)
         except Exception as e:
@@ -133,9 +877,44 @@ class Converter2vertical:
         Returns:
             str: The text content extracted from the XML file.
         """
-        tree = ET.parse(file)
-        root = ET.tostring(tree.getroot(), encoding='utf-8', method='text')
-        return root.decode('utf-8')
+        return ''.join(self.iter_xml_text(file))
+
+    def iter_xml_text(self, file):
+        """
+        Extracts the text of an XML file while parsing it, as ET.tostring(method='text') would.
+
+        The texts and tails are emitted in document order and the elements are dropped once
+        their text is out, so the memory does not grow with the size of the file. The text of
+        an element is only complete at the next event of the parser, and the tail of an element
+        at the event after its end, so both are emitted then.
+
+        Parameters:
+            file (str or file): The path to the XML file, or its binary file object.
+
+        Returns:
+            generator: The text of the file, in pieces.
+        """
+        stack = []
+        pending_text = pending_tail = None
+        for event, element in ET.iterparse(file, events=('start', 'end')):
+            if pending_text is not None:
+                if pending_text.text:
+                    yield pending_text.text
+                pending_text = None
+            if pending_tail is not None:
+                if pending_tail.tail:
+                    yield pending_tail.tail
+                # Only the element whose tail was pending is left in its parent.
+                del stack[-1][:]
+                pending_tail = None
+            if event == 'start':
+                stack.append(element)
+                pending_text = element
+            else:
+                stack.pop()
+                # The tail of the root element is not part of its text.
+                if stack:
+                    pending_tail = element
 
     def docx_2txt(self, file):
         """
@@ -147,6 +926,8 @@ class Converter2vertical:
         Returns:
             str: The content of the converted txt file.
         """
+        import docx2txt
+
         return docx2txt.process(file)
 
     def txt2vertical(self, text):
@@ -161,13 +942,44 @@ class Converter2vertical:
         """
         if type(text) != str:
             text = str(text)
-        splited = re.findall(r'\w+|[^\s\w]+', text)
+        splited = self.tokenizer.vertical_lines(self.tokenizer.tokenize(text))
         return '\n'.join(splited) + '\n </doc>'
 
+    def iter_token_batches(self, text, chunk_size=CHUNK_SIZE):
+        """
+        Tokenizes a text chunk by chunk, as txt2vertical does, without holding all its tokens.
+
+        Parameters:
+            text (str or file): The text, or a text file object to read it from.
+            chunk_size (int): The number of characters read at a time.
+
+        Returns:
+            generator: Lists of tokens, in the order of the text.
+        """
+        return self.tokenizer.iter_token_batches(text, chunk_size)
+
+    def write_vertical(self, text, outfile, chunk_size=CHUNK_SIZE, closing=' </doc>'):
+        """
+        Writes the vertical form of a text to a file, with the same output as txt2vertical.
+
+        Parameters:
+            text (str or file): The text, or a text file object to read it from.
+            outfile (file): The text file object to write to.
+            chunk_size (int): The number of characters tokenized at a time.
+            closing (str): The line written after the tokens.
+
+        Returns:
+            None
+        """
+        self.tokenizer.write_vertical(text, outfile, chunk_size, closing)
+
     def add_metadata(self, json_filename):
         """
         Adds metadata from a JSON file to an XML document.
 
+        The JSON file and the rendered document are cached by the metadata store, so that
+        supplementary files sharing the metadata of their review do not parse it again.
+
         Parameters:
             json_filename (str): The path to the JSON file.
 
@@ -179,26 +991,25 @@ class Converter2vertical:
             json.JSONDecodeError: If there is an error parsing the JSON.
         """
         try:
-            # Load JSON data from the provided file
-            with open(json_filename, 'r') as json_file:
-                print('Adding metadata from ' + json_filename)
-                json_data = json.load(json_file)
-
-            # Create the root "doc" element
-            root = ET.Element("doc")
-
-            # Convert JSON to SGML/XML
-            json_to_sgml(json_data, root)
-
-            # Create an ElementTree object
-            tree = ET.ElementTree(root)
-
-            # Print or save the XML as needed
-            xml_str = ET.tostring(root, encoding="unicode")
-            # Do not close the doc element: we will add sentences after it.
-            return xml_str
+            print('Adding metadata from ' + json_filename)
+            return self.metadata_store.render(json_filename, self.metadata_to_sgml)
 
         except FileNotFoundError:
             print(f"File not found: {json_filename}")
         except json.JSONDecodeError as e:
             print(f"Error parsing JSON: {e}")
+
+    def metadata_to_sgml(self, json_data):
+        """
+        Renders parsed metadata as a "doc" element.
+
+        Parameters:
+            json_data: The parsed JSON data.
+
+        Returns:
+            str: The XML document as a string.
+        """
+        # Convert JSON to SGML/XML under a "doc" root element, as json_to_sgml and ET.tostring do
+        xml_str = render_sgml(json_data)
+        # Do not close the doc element: we will add sentences after it.
+        return xml_str
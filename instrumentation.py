@@ -0,0 +1,127 @@
+import csv
+import heapq
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the buckets of the per-extension duration histograms.
+HISTOGRAM_BUCKETS = [0.01, 0.1, 1, 10, 60, float('inf')]
+
+
+def bucket_name(seconds):
+    for bound in HISTOGRAM_BUCKETS:
+        if seconds < bound:
+            return f'<{bound}s' if bound != float('inf') else f'>={HISTOGRAM_BUCKETS[-2]}s'
+
+
+class RunReport:
+    def __init__(self, slowest=20):
+        """
+        Collects the timers and counters of a conversion run.
+
+        Args:
+            slowest (int): The number of slowest files that are kept.
+
+        Returns:
+            None
+        """
+        self.started = time.time()
+        self.stages = defaultdict(float)
+        self.counters = Counter()
+        self.extensions = {}
+        self.max_slowest = slowest
+        self.slowest = []
+        # Predicted and actual makespan of the runs ordered by a Scheduler.
+        self.schedule = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times a block of code and adds its duration to a stage.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def count(self, name, number=1):
+        self.counters[name] += number
+
+    def add_file(self, path, extension, size, timings):
+        """
+        Records the conversion of a file.
+
+        Args:
+            path (str): The path of the file.
+            extension (str): The extension of the file.
+            size (int): The size of the file in bytes.
+            timings (dict): The seconds spent in each stage of the conversion of the file.
+
+        Returns:
+            None
+        """
+        seconds = sum(timings.values())
+        for name, stage_seconds in timings.items():
+            self.stages[name] += stage_seconds
+        self.counters['files'] += 1
+        statistics = self.extensions.setdefault(extension, {'files': 0, 'bytes': 0, 'seconds': 0.0,
+                                                            'histogram': Counter()})
+        statistics['files'] += 1
+        statistics['bytes'] += size
+        statistics['seconds'] += seconds
+        statistics['histogram'][bucket_name(seconds)] += 1
+        # Min-heap of the slowest files: the fastest of them is replaced first.
+        item = (seconds, path, extension, size)
+        if len(self.slowest) < self.max_slowest:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def to_dict(self):
+        return {'started': self.started,
+                'elapsed': time.time() - self.started,
+                'stages': dict(self.stages),
+                'counters': dict(self.counters),
+                'extensions': {extension: dict(statistics, histogram=dict(statistics['histogram']))
+                               for extension, statistics in self.extensions.items()},
+                'slowest': [{'path': path, 'extension': extension, 'bytes': size, 'seconds': seconds}
+                            for seconds, path, extension, size in sorted(self.slowest, reverse=True)],
+                'schedule': dict(self.schedule)}
+
+    def save_json(self, path):
+        with open(path, 'w', encoding='utf-8') as report_file:
+            json.dump(self.to_dict(), report_file, indent=1)
+
+    def save_csv(self, path):
+        """
+        Writes the report as rows of (section, name, measure, value).
+
+        Args:
+            path (str): The path of the CSV file.
+
+        Returns:
+            None
+        """
+        report = self.to_dict()
+        with open(path, 'w', encoding='utf-8', newline='') as report_file:
+            writer = csv.writer(report_file)
+            writer.writerow(['section', 'name', 'measure', 'value'])
+            writer.writerow(['run', 'run', 'elapsed', report['elapsed']])
+            for name, seconds in report['stages'].items():
+                writer.writerow(['stage', name, 'seconds', seconds])
+            for name, value in report['counters'].items():
+                writer.writerow(['counter', name, 'count', value])
+            for extension, statistics in report['extensions'].items():
+                for measure in ('files', 'bytes', 'seconds'):
+                    writer.writerow(['extension', extension, measure, statistics[measure]])
+                for bucket, value in statistics['histogram'].items():
+                    writer.writerow(['histogram', extension, bucket, value])
+            for name, value in report['schedule'].items():
+                writer.writerow(['schedule', 'run', name, value])
+            for slow_file in report['slowest']:
+                writer.writerow(['slowest', slow_file['path'], 'seconds', slow_file['seconds']])
@@ -0,0 +1,171 @@
+# Builds the inventory of a corpus: the files, bytes and extensions of each article and journal, and
+# the keys and schema variants of the metadata.
+# Usage:
+# python inventory.py <corpus> [--workers N] [--output inventory.json]
+#
+# The corpus is laid out as for Converter2vertical: reviewed_articles/<article>/metadata.json and
+# reviewed_articles/<article>/sub-articles/<files>. The articles are read in parallel and each JSON
+# file is parsed once. The saved inventory lists the files and bytes of every article by extension,
+# from which a Scheduler estimates the conversion costs without reading the size of every file.
+
+import argparse
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+INVENTORY_NAME = 'inventory.json'
+
+
+def read_keys(path):
+    # The keys and journal of a metadata file, or None if it is not a JSON object.
+    try:
+        with open(path, 'r', encoding='utf-8') as json_file:
+            data = json.load(json_file)
+    except (OSError, ValueError):
+        return None, None
+    if not isinstance(data, dict):
+        return None, None
+    return tuple(data), data.get('journal')
+
+
+def inventory_article(article_path):
+    """
+    Lists the files and metadata of one article.
+
+    Args:
+        article_path (str): The path of the article directory.
+
+    Returns:
+        dict: The journal of the article, its files and bytes by extension, and the key tuples of
+        its article and file metadata.
+    """
+    article = {'journal': None, 'files': Counter(), 'bytes': Counter(), 'article_keys': None,
+               'file_keys': [], 'unreadable': 0}
+    directories = [article_path, os.path.join(article_path, 'sub-articles')]
+    for directory in directories:
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            extension = os.path.splitext(entry.name)[1].lower()
+            article['files'][extension] += 1
+            article['bytes'][extension] += entry.stat().st_size
+            if extension != '.json':
+                continue
+            keys, journal = read_keys(entry.path)
+            if keys is None:
+                article['unreadable'] += 1
+            elif directory == article_path and entry.name == 'metadata.json':
+                article['article_keys'] = keys
+                # The journal of the article metadata wins over the one of its files.
+                if journal:
+                    article['journal'] = str(journal)
+            else:
+                article['file_keys'].append(keys)
+                if journal and not article['journal']:
+                    article['journal'] = str(journal)
+    return article
+
+
+def build_inventory(inpath, workers=None):
+    """
+    Builds the inventory of a corpus, reading its articles in a process pool.
+
+    Args:
+        inpath (str): The path to the corpus, containing the "reviewed_articles" folder.
+        workers (int): The number of processes. None uses all cores.
+
+    Returns:
+        dict: The totals by extension and by journal, the frequencies of the metadata keys, the
+        schema variants of the metadata, and the files and bytes of each article.
+    """
+    articles_path = os.path.join(inpath, 'reviewed_articles')
+    with os.scandir(articles_path) as entries:
+        names = sorted(entry.name for entry in entries if entry.is_dir())
+    extension_files, extension_bytes = Counter(), Counter()
+    journal_files, journal_bytes, journal_articles = Counter(), Counter(), Counter()
+    article_keys, file_keys, schemas = Counter(), Counter(), Counter()
+    articles = {}
+    unreadable = 0
+    paths = [os.path.join(articles_path, name) for name in names]
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as executor:
+        results = executor.map(inventory_article, paths, chunksize=max(1, len(paths) // (workers * 4)))
+        for name, article in zip(names, results):
+            journal = article['journal'] or 'unknown'
+            files = sum(article['files'].values())
+            size = sum(article['bytes'].values())
+            extension_files.update(article['files'])
+            extension_bytes.update(article['bytes'])
+            journal_files[journal] += files
+            journal_bytes[journal] += size
+            journal_articles[journal] += 1
+            if article['article_keys'] is not None:
+                article_keys.update(article['article_keys'])
+            for keys in article['file_keys']:
+                file_keys.update(keys)
+                schemas[tuple(sorted(keys))] += 1
+            unreadable += article['unreadable']
+            articles[name] = {'journal': journal, 'files': files, 'bytes': size,
+                              'extension_files': dict(article['files']), 'extension_bytes': dict(article['bytes'])}
+    return {'inpath': inpath,
+            'articles_count': len(articles),
+            'files': sum(extension_files.values()),
+            'bytes': sum(extension_bytes.values()),
+            'unreadable_metadata': unreadable,
+            'extensions': {extension: {'files': extension_files[extension], 'bytes': extension_bytes[extension]}
+                           for extension in sorted(extension_files)},
+            'journals': {journal: {'articles': journal_articles[journal], 'files': journal_files[journal],
+                                   'bytes': journal_bytes[journal]} for journal in sorted(journal_files)},
+            'article_metadata_keys': dict(article_keys.most_common()),
+            'file_metadata_keys': dict(file_keys.most_common()),
+            'schema_variants': [{'keys': list(keys), 'files': count} for keys, count in schemas.most_common()],
+            'articles': articles}
+
+
+def largest_first(inventory):
+    """
+    Returns the articles of an inventory from the largest to the smallest.
+
+    Args:
+        inventory (dict): An inventory built by build_inventory.
+
+    Returns:
+        list: The names of the articles.
+    """
+    return sorted(inventory['articles'], key=lambda name: (-inventory['articles'][name]['bytes'], name))
+
+
+def save_inventory(inventory, path):
+    with open(path, 'w', encoding='utf-8') as inventory_file:
+        json.dump(inventory, inventory_file, indent=1)
+
+
+def load_inventory(path):
+    with open(path, 'r', encoding='utf-8') as inventory_file:
+        return json.load(inventory_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the inventory of a corpus.')
+    parser.add_argument('inpath', help='The corpus, containing the "reviewed_articles" folder.')
+    parser.add_argument('--workers', type=int, help='The number of processes. By default, all cores.')
+    parser.add_argument('--output', default=INVENTORY_NAME, help='The JSON file the inventory is written to.')
+    args = parser.parse_args()
+
+    inventory = build_inventory(args.inpath, args.workers)
+    save_inventory(inventory, args.output)
+    print(f'{inventory["articles_count"]} articles, {inventory["files"]} files, {inventory["bytes"]} bytes')
+    for extension, totals in inventory['extensions'].items():
+        print(f'{extension:>10}: {totals["files"]:8} files {totals["bytes"]:14} bytes')
+    for journal, totals in inventory['journals'].items():
+        print(f'{journal}: {totals["articles"]} articles, {totals["files"]} files, {totals["bytes"]} bytes')
+    print(f'{len(inventory["schema_variants"])} metadata schema variants')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = 'conversion_manifest.json'
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """
+    Computes the SHA-256 of a file without loading it in memory.
+
+    Args:
+        path (str): The path of the file.
+        chunk_size (int): The number of bytes read at a time.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(path, previous=None):
+    """
+    Describes the content of a file by its size, modification time and hash.
+
+    The hash of the previous fingerprint is reused when size and modification time did not
+    change, so unchanged files are not read again.
+
+    Args:
+        path (str): The path of the file.
+        previous (dict): A fingerprint of the same file from an earlier run, or None.
+
+    Returns:
+        dict or None: The fingerprint, None if there is no path or the file does not exist.
+    """
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if previous is not None and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+        sha256 = previous['sha256']
+    else:
+        sha256 = file_sha256(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+
+
+class ConversionManifest:
+    def __init__(self, path, version, save_interval=100):
+        """
+        Records, for each output file, the source and metadata it was built from.
+
+        Args:
+            path (str): The path of the manifest JSON file.
+            version (str): The converter version; outputs of another version are rebuilt.
+            save_interval (int): The number of recorded outputs after which the manifest is saved,
+                so that an interrupted run can resume from there.
+
+        Returns:
+            None
+        """
+        self.path = path
+        self.version = version
+        self.save_interval = save_interval
+        self.unsaved = 0
+        self.entries = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as manifest_file:
+                self.entries = json.load(manifest_file)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError as e:
+            print(f'Error parsing manifest {path}: {e}. Converting everything again.')
+
+    def describe(self, source_path, metadata_path, key=None):
+        """
+        Builds the manifest entry of an output from its source and metadata files.
+
+        Args:
+            source_path (str): The path of the converted file.
+            metadata_path (str): The path of its metadata JSON file, or None.
+            key (str): The key of a previous entry whose hashes may be reused.
+
+        Returns:
+            dict: The manifest entry.
+        """
+        previous = self.entries.get(key, {})
+        return {'source_path': source_path,
+                'source': fingerprint(source_path, previous.get('source')),
+                'metadata': fingerprint(metadata_path, previous.get('metadata')),
+                'version': self.version}
+
+    def is_current(self, key, output_path, source_path, metadata_path):
+        """
+        Tells whether an output is up to date with its source and metadata.
+
+        Args:
+            key (str): The key of the output in the manifest.
+            output_path (str): The path of the output file.
+            source_path (str): The path of the converted file.
+            metadata_path (str): The path of its metadata JSON file, or None.
+
+        Returns:
+            bool: True if the output can be kept as it is.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry['version'] != self.version or not os.path.exists(output_path):
+            return False
+        current = self.describe(source_path, metadata_path, key)
+        if current['source'] is None:
+            return False
+        for name in ('source', 'metadata'):
+            if (entry[name] is None) != (current[name] is None):
+                return False
+            if entry[name] is not None and entry[name]['sha256'] != current[name]['sha256']:
+                return False
+        # Keep the new modification times so the files are not hashed again next time.
+        self.entries[key] = current
+        return True
+
+    def record(self, key, entry):
+        self.entries[key] = entry
+        self.unsaved += 1
+        if self.unsaved >= self.save_interval:
+            self.save()
+
+    def prune(self, keys, outpath):
+        """
+        Removes the outputs whose source is no longer part of the corpus.
+
+        Args:
+            keys (set): The keys of the outputs that are still expected.
+            outpath (str): The output directory the keys are relative to.
+
+        Returns:
+            None
+        """
+        for key in set(self.entries) - set(keys):
+            output_path = os.path.join(outpath, key)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            del self.entries[key]
+            self.unsaved += 1
+
+    def save(self):
+        # Write through a temporary file: an interrupted save must not lose the manifest.
+        temp_path = self.path + '.part'
+        with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(self.entries, manifest_file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+        self.unsaved = 0
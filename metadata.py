@@ -8,6 +8,9 @@ import sys
 import json
 import xml.etree.ElementTree as ET
 
+# Text of the elements that have none, as values like "" or 0 are texts.
+NO_TEXT = object()
+
 
 def json_to_sgml(json_data, parent):
     if isinstance(json_data, dict):
@@ -29,40 +32,145 @@ def json_to_sgml(json_data, parent):
         parent.text = str(json_data)
 
 
-# Check if a JSON filename is provided as a command-line argument
-class InvalidArgumentException(Exception):
-    pass
+def element_content(values):
+    """
+    Computes what json_to_sgml would put in an element, given the JSON values applied to it.
+
+    Nested lists are flattened with a stack instead of recursion.
 
+    Args:
+        values (list): The JSON values applied to the element, in order.
 
-try:
-    if len(sys.argv) != 2:
-        raise InvalidArgumentException("Usage: python test_using_real_files.py <filename>")
+    Returns:
+        tuple: The attributes (dict), the text and the children, as (tag, values) pairs, of the
+        element. Attribute values and text are returned as they are in the JSON data; the text is
+        NO_TEXT when the element has none.
+    """
+    attributes = {}
+    children = []
+    stack = [iter(values)]
+    text = NO_TEXT
+    while stack:
+        value = next(stack[-1], NO_TEXT)
+        if value is NO_TEXT:
+            stack.pop()
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if isinstance(item, list):
+                    children.append((key, item))
+                else:
+                    attributes[key] = item
+        elif isinstance(value, list):
+            stack.append(iter(value))
+        else:
+            text = value
+    return attributes, text, children
 
-    # Get the JSON filename from the command line argument
-    json_filename = sys.argv[1]
 
-    # Load JSON data from the provided file
-    with open(json_filename, 'r') as json_file:
-        json_data = json.load(json_file)
+def render_sgml(json_data, tag='doc', write=None):
+    """
+    Renders JSON data as the element json_to_sgml builds, serialized like ET.tostring.
+
+    The SGML is written piece by piece without building an ElementTree, and nested elements are
+    handled with a stack, so long lists and deep nesting cost neither objects nor recursion.
+
+    Args:
+        json_data: The parsed JSON data.
+        tag (str): The tag of the root element.
+        write (callable): Receives the SGML piece by piece, e.g. the write method of a file.
+            By default, the SGML is returned as a string.
+
+    Returns:
+        str or None: The SGML, or None if it was passed to write.
+    """
+    parts = None
+    if write is None:
+        parts = []
+        write = parts.append
+    # ElementTree's own escaping, so that the output stays identical to ET.tostring.
+    escape_attribute = ET._escape_attrib
+    escape_text = ET._escape_cdata
+    stack = [(tag, [json_data])]
+    while stack:
+        tag, values = stack.pop()
+        if values is None:
+            write('</' + tag + '>')
+            continue
+        # Fast path of element_content for the usual lists of dicts or of plain values.
+        # Values are only converted to strings once they are known to be the last ones.
+        attributes = {}
+        children = []
+        text = NO_TEXT
+        for value in values:
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    if isinstance(item, list):
+                        children.append((key, item))
+                    else:
+                        attributes[key] = item
+            elif isinstance(value, list):
+                attributes, text, children = element_content(values)
+                break
+            else:
+                text = value
+        text = str(text) if text is not NO_TEXT else None
+        start_tag = '<' + tag + ''.join([' ' + key + '="' + escape_attribute(str(value)) + '"'
+                                         for key, value in attributes.items()])
+        if text or children:
+            write(start_tag + '>' + escape_text(text) if text else start_tag + '>')
+            stack.append((tag, None))
+            stack.extend(reversed(children))
+        else:
+            write(start_tag + ' />')
+    if parts is not None:
+        return ''.join(parts)
+
+
+def render_sgml_many(json_documents, tag='doc'):
+    """
+    Renders the headers of many JSON documents.
+
+    Args:
+        json_documents (iterable): The parsed JSON data of each document.
+        tag (str): The tag of the root elements.
+
+    Returns:
+        list: The SGML of each document.
+    """
+    headers = []
+    for json_data in json_documents:
+        parts = []
+        render_sgml(json_data, tag, parts.append)
+        headers.append(''.join(parts))
+    return headers
+
+
+# Check if a JSON filename is provided as a command-line argument
+class InvalidArgumentException(Exception):
+    pass
+
 
-    # Create the root "doc" element
-    root = ET.Element("doc")
+if __name__ == '__main__':
+    try:
+        if len(sys.argv) != 2:
+            raise InvalidArgumentException("Usage: python test_using_real_files.py <filename>")
 
-    # Convert JSON to SGML/XML
-    json_to_sgml(json_data, root)
+        # Get the JSON filename from the command line argument
+        json_filename = sys.argv[1]
 
-    # Create an ElementTree object
-    tree = ET.ElementTree(root)
+        # Load JSON data from the provided file
+        with open(json_filename, 'r') as json_file:
+            json_data = json.load(json_file)
 
-    # Print or save the XML as needed
-    xml_str = ET.tostring(root, encoding="unicode")
-    # Do not close the doc element: we will add sentences after it.
-    print(xml_str[:-6])
+        # Convert JSON to SGML/XML under a "doc" root element
+        xml_str = render_sgml(json_data)
+        # Do not close the doc element: we will add sentences after it.
+        print(xml_str[:-6])
 
-except InvalidArgumentException as e:
-    print(e)
-    sys.exit(1)
-except FileNotFoundError:
-    print(f"File not found: {json_filename}")
-except json.JSONDecodeError as e:
-    print(f"Error parsing JSON: {e}")
+    except InvalidArgumentException as e:
+        print(e)
+        sys.exit(1)
+    except FileNotFoundError:
+        print(f"File not found: {json_filename}")
+    except json.JSONDecodeError as e:
+        print(f"Error parsing JSON: {e}")
@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class MetadataStore:
+    def __init__(self, max_directories=64, max_headers=4096):
+        """
+        Cache of the metadata JSON files of the corpus and of the headers rendered from them.
+
+        The first access to a metadata file parses every JSON file of its directory, so that a
+        review and its supplementary files, which share the same "*.rN.json", are parsed once.
+        The store can be shared by threads: only the lookups and updates of the caches hold its
+        lock, so the JSON files of several directories can be read at the same time.
+
+        Args:
+            max_directories (int): The number of directories whose parsed JSON files are kept.
+            max_headers (int): The number of rendered headers that are kept.
+
+        Returns:
+            None
+        """
+        self.max_directories = max_directories
+        self.max_headers = max_headers
+        self.directories = OrderedDict()
+        self.headers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks cannot be pickled: worker processes get their own.
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def load_directory(self, directory):
+        """
+        Parses every JSON file of a directory.
+
+        Args:
+            directory (str): The path of the directory.
+
+        Returns:
+            dict: The parsed data, or the error raised while decoding it, by file name.
+        """
+        documents = {}
+        try:
+            with os.scandir(directory) as entries:
+                names = [entry.name for entry in entries if entry.name.endswith('.json') and entry.is_file()]
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as json_file:
+                try:
+                    documents[name] = json.load(json_file)
+                except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                    documents[name] = e
+        return documents
+
+    def load(self, json_filename):
+        """
+        Returns the parsed content of a metadata JSON file.
+
+        Args:
+            json_filename (str): The path to the JSON file.
+
+        Returns:
+            The parsed JSON data. It is shared with the other callers and must not be modified.
+
+        Raises:
+            FileNotFoundError: If the JSON file is not found.
+            json.JSONDecodeError: If there is an error parsing the JSON.
+        """
+        directory, name = os.path.split(json_filename)
+        with self.lock:
+            documents = self.directories.get(directory)
+            if documents is not None:
+                self.directories.move_to_end(directory)
+        if documents is None:
+            # Read without the lock; two threads missing the same directory both parse it.
+            documents = self.load_directory(directory)
+            with self.lock:
+                self.directories[directory] = documents
+                if len(self.directories) > self.max_directories:
+                    self.directories.popitem(last=False)
+        if name not in documents:
+            raise FileNotFoundError(json_filename)
+        data = documents[name]
+        if isinstance(data, ValueError):
+            raise data
+        return data
+
+    def render(self, json_filename, renderer):
+        """
+        Returns a header rendered from a metadata JSON file, rendering it only once.
+
+        Args:
+            json_filename (str): The path to the JSON file.
+            renderer (callable): The function rendering the parsed JSON data to a string.
+                Renderers are told apart by their qualified name.
+
+        Returns:
+            str: The rendered header.
+
+        Raises:
+            FileNotFoundError: If the JSON file is not found.
+            json.JSONDecodeError: If there is an error parsing the JSON.
+        """
+        key = (json_filename, renderer.__qualname__)
+        with self.lock:
+            header = self.headers.get(key)
+            if header is not None:
+                self.headers.move_to_end(key)
+                return header
+        header = renderer(self.load(json_filename))
+        with self.lock:
+            self.headers[key] = header
+            if len(self.headers) > self.max_headers:
+                self.headers.popitem(last=False)
+        return header
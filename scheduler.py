@@ -0,0 +1,186 @@
+import heapq
+import json
+import os
+
+# Bytes converted per second by format, used until the conversions of a run are observed.
+# Measured with benchmark.py on the fixtures; doc files are guessed from the size of docx ones.
+DEFAULT_THROUGHPUT = {'.pdf': 0.5e6, '.doc': 2e6, '.docx': 4e6, '.xml': 4e6, '.txt': 20e6}
+# Seconds spent on every file whatever its size: opening, metadata and writing.
+FILE_OVERHEAD = 0.002
+
+
+class Scheduler:
+    def __init__(self, throughput=None, smoothing=0.5, inventory=None):
+        """
+        Orders conversion jobs longest first, from the expected cost of each file.
+
+        The cost of a file is a fixed overhead plus its size divided by the throughput of its
+        format. The throughputs are learned from the conversions of each run and can be saved,
+        so that the estimates of the next runs follow the corpus and the machine.
+
+        With an inventory, the size of a file is the mean size of the files of its extension in
+        its article, so that no file of the corpus is stat-ed again; the size of the files of
+        articles missing from the inventory is read from the file system.
+
+        Args:
+            throughput (dict): The bytes per second of each extension. By default,
+                DEFAULT_THROUGHPUT.
+            smoothing (float): The weight of a run's measured throughput against the previous
+                estimate.
+            inventory (dict): An inventory of the corpus built by inventory.build_inventory.
+
+        Returns:
+            None
+        """
+        self.throughput = dict(DEFAULT_THROUGHPUT)
+        self.throughput.update(throughput or {})
+        self.smoothing = smoothing
+        self.inventory = inventory
+        # Bytes and seconds of the conversions observed since the last update, by extension.
+        self.observed = {}
+        self.busy = 0.0
+        self.last_run = None
+
+    def estimate(self, job, size=None):
+        """
+        Returns the expected seconds of the conversion of a file.
+
+        Args:
+            job (CorpusEntry): The file.
+            size (int): The size of the file in bytes. By default, it is taken from the inventory
+                or read from the file system.
+
+        Returns:
+            float: The expected duration.
+        """
+        if size is None:
+            size = self.inventory_size(job)
+        if size is None:
+            try:
+                size = os.path.getsize(job.path)
+            except OSError:
+                size = 0
+        return FILE_OVERHEAD + size / self.throughput.get(job.extension, min(self.throughput.values()))
+
+    def inventory_size(self, job):
+        # The mean size of the files of the extension of a job in its article, or None if unknown.
+        if self.inventory is None:
+            return None
+        article = self.inventory['articles'].get(job.article)
+        if article is None or not article.get('extension_files', {}).get(job.extension):
+            return None
+        return article['extension_bytes'][job.extension] / article['extension_files'][job.extension]
+
+    def order(self, jobs):
+        """
+        Sorts jobs from the most to the least expensive.
+
+        Handing the sorted jobs one at a time to the first free worker is the longest processing
+        time first rule: the large files start first instead of ending the run alone.
+
+        Args:
+            jobs (list): The CorpusEntry of the files.
+
+        Returns:
+            tuple: The sorted jobs and their expected costs, in the same order.
+        """
+        costs = [self.estimate(job) for job in jobs]
+        ranked = sorted(range(len(jobs)), key=lambda position: -costs[position])
+        return [jobs[position] for position in ranked], [costs[position] for position in ranked]
+
+    def assign(self, costs, workers):
+        """
+        Bins sorted costs over workers, each going to the least loaded one.
+
+        Args:
+            costs (list): The costs of the jobs, in the order they are started.
+            workers (int): The number of workers.
+
+        Returns:
+            list: The positions of the jobs of each worker.
+        """
+        loads = [(0.0, worker) for worker in range(workers)]
+        bins = [[] for _ in range(workers)]
+        for position, cost in enumerate(costs):
+            load, worker = heapq.heappop(loads)
+            bins[worker].append(position)
+            heapq.heappush(loads, (load + cost, worker))
+        return bins
+
+    def predict_makespan(self, costs, workers):
+        """
+        Returns the expected duration of a run: the load of the busiest worker.
+
+        Args:
+            costs (list): The costs of the jobs, in the order they are started.
+            workers (int): The number of workers.
+
+        Returns:
+            float: The expected seconds.
+        """
+        return max((sum(costs[position] for position in positions) for positions in self.assign(costs, workers)),
+                   default=0.0)
+
+    def observe(self, extension, size, seconds):
+        """
+        Records the conversion of a file, for the throughput estimates.
+
+        Args:
+            extension (str): The extension of the file.
+            size (int): The size of the file in bytes.
+            seconds (float): The duration of the conversion.
+
+        Returns:
+            None
+        """
+        totals = self.observed.setdefault(extension, [0, 0.0])
+        totals[0] += size
+        totals[1] += max(seconds - FILE_OVERHEAD, 0.0)
+        self.busy += seconds
+
+    def record_run(self, predicted, actual, workers):
+        """
+        Keeps the predicted and actual makespan of a run and updates the throughputs from the
+        conversions observed during the run.
+
+        Args:
+            predicted (float): The predicted makespan in seconds.
+            actual (float): The wall-clock duration of the run in seconds.
+            workers (int): The number of workers.
+
+        Returns:
+            dict: The makespans and the balance of the run, the share of the workers' time
+            spent converting.
+        """
+        self.last_run = {'predicted_makespan': predicted, 'actual_makespan': actual,
+                         'balance': self.busy / (workers * actual) if actual else 1.0}
+        for extension, (size, seconds) in self.observed.items():
+            if size and seconds:
+                previous = self.throughput.get(extension, size / seconds)
+                self.throughput[extension] = (1 - self.smoothing) * previous + self.smoothing * size / seconds
+        self.observed = {}
+        self.busy = 0.0
+        return self.last_run
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as history_file:
+            json.dump({'throughput': self.throughput}, history_file, indent=1)
+
+    @classmethod
+    def load(cls, path, smoothing=0.5, inventory=None):
+        """
+        Creates a scheduler from the throughputs saved by an earlier run, if there is one.
+
+        Args:
+            path (str): The path of the saved throughputs.
+            smoothing (float): See Scheduler.
+            inventory (dict): See Scheduler.
+
+        Returns:
+            Scheduler: The scheduler.
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as history_file:
+                return cls(json.load(history_file)['throughput'], smoothing, inventory)
+        except FileNotFoundError:
+            return cls(smoothing=smoothing, inventory=inventory)
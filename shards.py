@@ -0,0 +1,207 @@
+import gzip
+import os
+
+INDEX_NAME = 'index.tsv'
+SHARD_EXTENSIONS = {None: '.vert', 'gz': '.vert.gz', 'zst': '.vert.zst'}
+# Compression levels of the documents: the defaults of zlib and zstd, several times faster than
+# gzip.compress's level 9 for a few percent of size.
+COMPRESSION_LEVELS = {'gz': 6, 'zst': 3}
+
+
+def load_zstandard():
+    # Optional dependency, only needed for .zst shards.
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstd shards need the zstandard package: pip install zstandard')
+    return zstandard
+
+
+def compress(data, compression):
+    """
+    Compresses one document as an independent gzip member or zstd frame.
+
+    Concatenated members or frames are still a valid .gz or .zst file, and each document can be
+    decompressed on its own from its offset.
+
+    Args:
+        data (bytes): The document.
+        compression (str): None, 'gz' or 'zst'.
+
+    Returns:
+        bytes: The stored bytes.
+    """
+    if compression is None:
+        return data
+    if compression == 'gz':
+        return gzip.compress(data, COMPRESSION_LEVELS['gz'], mtime=0)
+    return load_zstandard().ZstdCompressor(COMPRESSION_LEVELS['zst']).compress(data)
+
+
+def decompress(data, compression):
+    if compression is None:
+        return data
+    if compression == 'gz':
+        return gzip.decompress(data)
+    return load_zstandard().ZstdDecompressor().decompress(data)
+
+
+def encode_document(document, compression):
+    """
+    Returns the bytes of a document as stored in a shard.
+
+    The document is followed by a newline, so that its closing tag and the opening tag of the
+    next document are on separate lines. Encoding can be done in the worker that rendered the
+    document, and the bytes given to ShardWriter.add_encoded.
+
+    Args:
+        document (str): The vertical text of the document.
+        compression (str): None, 'gz' or 'zst'.
+
+    Returns:
+        bytes: The stored bytes.
+    """
+    return compress((document + '\n').encode('utf-8'), compression)
+
+
+def decode_document(data, compression):
+    # The inverse of encode_document, without the newline added after the document.
+    document = decompress(data, compression).decode('utf-8')
+    return document[:-1] if document.endswith('\n') else document
+
+
+class ShardWriter:
+    def __init__(self, directory, max_bytes=1024 ** 3, compression=None, prefix='corpus'):
+        """
+        Concatenates documents into size-bounded vertical files, with an index of their offsets.
+
+        The index (index.tsv) has one line per document: its id, its shard, and the offset and
+        length of its bytes in the shard. Each document is followed by a newline, counted in
+        its length.
+
+        Args:
+            directory (str): The directory of the shards and of the index.
+            max_bytes (int): The size after which a new shard is started.
+            compression (str): None, 'gz' or 'zst'.
+            prefix (str): The start of the names of the shards.
+
+        Returns:
+            None
+        """
+        if compression not in SHARD_EXTENSIONS:
+            raise ValueError(f'Unknown shard compression: {compression}')
+        if compression == 'zst':
+            load_zstandard()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.prefix = prefix
+        self.shard_number = -1
+        self.shard_name = None
+        self.shard_file = None
+        self.shard_size = 0
+        os.makedirs(directory, exist_ok=True)
+        self.index_file = open(os.path.join(directory, INDEX_NAME), 'w', encoding='utf-8')
+
+    def add(self, doc_id, document):
+        """
+        Appends a document to the current shard.
+
+        Args:
+            doc_id (str): The id of the document, without tabs or newlines.
+            document (str): The vertical text of the document.
+
+        Returns:
+            None
+        """
+        self.add_encoded(doc_id, encode_document(document, self.compression))
+
+    def add_encoded(self, doc_id, data):
+        """
+        Appends a document already encoded by encode_document with the compression of the shards.
+
+        Args:
+            doc_id (str): The id of the document, without tabs or newlines.
+            data (bytes): The stored bytes of the document.
+
+        Returns:
+            None
+        """
+        if self.shard_file is None or (self.shard_size and self.shard_size + len(data) > self.max_bytes):
+            self.next_shard()
+        self.shard_file.write(data)
+        self.index_file.write(f'{doc_id}\t{self.shard_name}\t{self.shard_size}\t{len(data)}\n')
+        self.shard_size += len(data)
+
+    def next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard_number += 1
+        self.shard_name = f'{self.prefix}-{self.shard_number:05d}{SHARD_EXTENSIONS[self.compression]}'
+        self.shard_file = open(os.path.join(self.directory, self.shard_name), 'wb')
+        self.shard_size = 0
+
+    def flush(self):
+        if self.shard_file is not None:
+            self.shard_file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file = None
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ShardReader:
+    def __init__(self, directory):
+        """
+        Reads single documents from shards written by ShardWriter.
+
+        Args:
+            directory (str): The directory of the shards and of the index.
+
+        Returns:
+            None
+        """
+        self.directory = directory
+        self.index = {}
+        with open(os.path.join(directory, INDEX_NAME), 'r', encoding='utf-8') as index_file:
+            for line in index_file:
+                doc_id, shard_name, offset, length = line.rstrip('\n').split('\t')
+                self.index[doc_id] = (shard_name, int(offset), int(length))
+
+    def ids(self):
+        return list(self.index)
+
+    def get(self, doc_id):
+        """
+        Returns a document, reading and decompressing only its own bytes.
+
+        Args:
+            doc_id (str): The id of the document.
+
+        Returns:
+            str: The vertical text of the document.
+
+        Raises:
+            KeyError: If the document is not in the index.
+        """
+        shard_name, offset, length = self.index[doc_id]
+        with open(os.path.join(self.directory, shard_name), 'rb') as shard_file:
+            shard_file.seek(offset)
+            data = shard_file.read(length)
+        return decode_document(data, shard_compression(shard_name))
+
+
+def shard_compression(shard_name):
+    for compression, extension in SHARD_EXTENSIONS.items():
+        if compression is not None and shard_name.endswith(extension):
+            return compression
+    return None
@@ -0,0 +1,182 @@
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: memory limits are then not enforced.
+    resource = None
+
+
+def _supervised_worker(connection, target, initializer, initargs, memory_limit):
+    if memory_limit is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        job_id, job = message
+        try:
+            result = target(job)
+        except MemoryError:
+            result = MemoryError(f'Memory limit of {memory_limit} bytes exceeded')
+        connection.send((job_id, result))
+
+
+class Supervisor:
+    def __init__(self, target, workers, timeout=None, memory_limit=None, retries=1, initializer=None,
+                 initargs=()):
+        """
+        Runs jobs in worker processes that are killed when a job runs for too long.
+
+        Unlike a process pool, each worker runs one job at a time, so a hung or crashed job only
+        costs its own worker, which is replaced. Jobs that keep failing are put in quarantine.
+        Used as a context manager, the supervisor keeps its workers between calls to run.
+
+        Args:
+            target (callable): The module-level function run on each job in the workers.
+            workers (int): The number of worker processes.
+            timeout (float): The wall-clock limit of a job in seconds, None for no limit.
+            memory_limit (int): The address space limit of a worker in bytes, None for no limit.
+            retries (int): How many times a job is run again after its worker hung or crashed.
+            initializer (callable): A function run once in each new worker.
+            initargs (tuple): The arguments of initializer.
+
+        Returns:
+            None
+        """
+        self.target = target
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.retries = retries
+        self.initializer = initializer
+        self.initargs = initargs
+        self.quarantine = []
+        # The idle workers kept for the next run, inside the context manager.
+        self.idle = []
+        self.persistent = False
+
+    def __enter__(self):
+        self.persistent = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.persistent = False
+        self.stop_workers(self.idle)
+        self.idle = []
+
+    def start_worker(self):
+        connection, child_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_supervised_worker,
+                                          args=(child_connection, self.target, self.initializer,
+                                                self.initargs, self.memory_limit),
+                                          daemon=True)
+        process.start()
+        child_connection.close()
+        return {'process': process, 'connection': connection, 'job': None, 'started': None}
+
+    def stop_worker(self, worker):
+        if worker['process'].is_alive():
+            worker['process'].kill()
+        worker['process'].join()
+        worker['connection'].close()
+
+    def run(self, jobs):
+        """
+        Runs the jobs and yields their results as they complete.
+
+        Args:
+            jobs (list): The jobs, passed one by one to target.
+
+        Returns:
+            generator: (job, result, error) tuples. error is None when target returned result,
+            otherwise the job was put in quarantine and result is None.
+        """
+        pending = deque((job_id, job, 0) for job_id, job in enumerate(jobs))
+        workers = [worker for worker in self.idle if worker['process'].is_alive()]
+        self.stop_workers([worker for worker in self.idle if worker not in workers])
+        self.idle = []
+        try:
+            while pending or any(worker['job'] is not None for worker in workers):
+                for worker in workers:
+                    if worker['job'] is None and pending:
+                        self.assign(worker, pending.popleft())
+                while pending and len(workers) < self.workers:
+                    worker = self.start_worker()
+                    workers.append(worker)
+                    self.assign(worker, pending.popleft())
+
+                busy = [worker for worker in workers if worker['job'] is not None]
+                ready = wait([worker['connection'] for worker in busy]
+                             + [worker['process'].sentinel for worker in busy], self.wait_time(busy))
+                for worker in busy:
+                    job_id, job, attempts = worker['job']
+                    if worker['connection'] in ready:
+                        try:
+                            _, result = worker['connection'].recv()
+                        except EOFError:
+                            pass
+                        else:
+                            worker['job'] = None
+                            if isinstance(result, MemoryError):
+                                yield job, None, self.add_to_quarantine(job, str(result), attempts + 1)
+                            else:
+                                yield job, result, None
+                            continue
+                    if worker['process'].sentinel in ready:
+                        self.stop_worker(worker)
+                        reason = f'Worker exited with code {worker["process"].exitcode}'
+                    elif self.timeout is not None and time.monotonic() - worker['started'] > self.timeout:
+                        self.stop_worker(worker)
+                        reason = f'Timed out after {self.timeout} seconds'
+                    else:
+                        continue
+                    # The worker crashed or hung: replace it and run the job again, or give up.
+                    workers[workers.index(worker)] = replacement = self.start_worker()
+                    if attempts < self.retries:
+                        print(f'{reason} on {job}, retrying.')
+                        pending.append((job_id, job, attempts + 1))
+                    else:
+                        yield job, None, self.add_to_quarantine(job, reason, attempts + 1)
+                    if pending:
+                        self.assign(replacement, pending.popleft())
+        finally:
+            # Workers still running a job, when the run was interrupted, are never reused.
+            busy = [worker for worker in workers if worker['job'] is not None]
+            idle = [worker for worker in workers if worker['job'] is None]
+            self.stop_workers(busy)
+            if self.persistent:
+                self.idle = idle
+            else:
+                self.stop_workers(idle)
+
+    def stop_workers(self, workers):
+        for worker in workers:
+            try:
+                worker['connection'].send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in workers:
+            worker['process'].join(1)
+            self.stop_worker(worker)
+
+    def assign(self, worker, pending_job):
+        job_id, job, attempts = pending_job
+        worker['job'] = pending_job
+        worker['started'] = time.monotonic()
+        worker['connection'].send((job_id, job))
+
+    def wait_time(self, busy):
+        if self.timeout is None:
+            return None
+        deadline = min(worker['started'] for worker in busy) + self.timeout
+        return max(0, deadline - time.monotonic())
+
+    def add_to_quarantine(self, job, reason, attempts):
+        self.quarantine.append((job, reason, attempts))
+        return reason
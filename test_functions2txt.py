@@ -1,7 +1,49 @@
 import pytest
 import os
 import glob
+import pickle
+import multiprocessing
+import gzip
+import io
+import shutil
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from functions2txt import Converter2vertical
+from add_metadata import AddMetadata
+from corpus_index import CorpusIndex
+from metadata_store import MetadataStore
+from extraction_cache import ExtractionCache
+from instrumentation import RunReport
+from async_pipeline import AsyncConverter
+from shards import ShardReader
+from tokenizer import TOKEN_PATTERN, Tokenizer, lowercase_column
+from work_queue import WorkQueue
+from inventory import build_inventory, largest_first, load_inventory, save_inventory
+from scheduler import Scheduler
+from metadata import json_to_sgml, render_sgml, render_sgml_many
+
+# Seconds that importing functions2txt may take in a new process (about 0.1 s without the
+# extractors, which are only imported when a file needs them).
+STARTUP_TARGET = 0.3
+
+
+def hang(file):
+    time.sleep(60)
+
+
+def allocate(file):
+    return ' ' * (3 * 1024 ** 3)
+
+
+def process_id(file):
+    return f'pid{os.getpid()}'
+
+
+def queue_worker(corpus, output_dir, database):
+    Converter2vertical(corpus, output_dir, work_queue=WorkQueue(database, lease_seconds=1)).work(poll_interval=0.1)
 
 
 class TestConverter2vertical:
@@ -50,8 +92,435 @@ class TestConverter2vertical:
                 output_file.write(result)
             assert os.path.exists(output_file_path), 'Output file was not created'
 
+    def test_streaming_extraction(self):
+        for xml in ('<a>t1<b>t2<c/>t3</b>t4<!-- x -->t5<d>t6</d>t7</a>', '<r/>',
+                    '<r xmlns="u">x<![CDATA[<y>]]>&amp;<s>z</s>w</r>'):
+            expected = ET.tostring(ET.fromstring(xml), encoding='utf-8', method='text').decode('utf-8')
+            assert self.converter.xml2txt(io.BytesIO(xml.encode('utf-8'))) == expected
+
+        with open(os.path.join(self.input_dir, 'dummy.txt'), 'rb') as txt_file:
+            text = ''.join(self.converter.txt2txt(txt_file, chunk_size=3))
+        with open(os.path.join(self.input_dir, 'dummy.txt'), 'r', encoding='utf-8-sig') as txt_file:
+            assert text == txt_file.read()
+        assert ''.join(self.converter.txt2txt(io.BytesIO(b'\xef\xbb\xbfa \xc3\xa9 \xff'))) == 'a \xe9 \ufffd'
+
     def test_txt2vertical(self):
         text = 'This is a test text.'
         expected = 'This\nis\na\ntest\ntext\n.\n </doc>'
         result_1 = self.converter.txt2vertical(text)
         assert result_1 == expected
+
+    def test_write_vertical(self):
+        for text in ('This is a test text.', 'Tokens,, cross chunk-boundaries...', '', '   '):
+            for chunk_size in (1, 4, 1000):
+                output = io.StringIO()
+                self.converter.write_vertical(text, output, chunk_size)
+                assert output.getvalue() == self.converter.txt2vertical(text)
+
+    def build_corpus(self, tmp_path):
+        corpus = tmp_path / 'corpus'
+        for article in ('a1', 'a2'):
+            sub_articles = corpus / 'reviewed_articles' / article / 'sub-articles'
+            sub_articles.mkdir(parents=True)
+            shutil.copy(os.path.join(self.input_dir, 'xml_test.xml'), sub_articles / (article + '.r1.xml'))
+            shutil.copy(os.path.join(self.input_dir, 'dummy.txt'), sub_articles / (article + '.s1.txt'))
+            shutil.copy(os.path.join(self.input_dir, 'valid_metadata.json'), sub_articles / (article + '.r1.json'))
+        return str(corpus) + '/'
+
+    def read_outputs(self, output_dir):
+        return {os.path.relpath(path, output_dir): open(path, encoding='utf-8').read()
+                for path in glob.glob(output_dir + '**/*.txt', recursive=True)}
+
+    def test_parallel_conversion(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        outputs = {}
+        for workers in (1, 2):
+            output_dir = str(tmp_path / f'output_{workers}') + '/'
+            converter = Converter2vertical(corpus, output_dir, workers=workers)
+            converter.iterate_through_corpus()
+            assert converter.failures == {}
+            outputs[workers] = self.read_outputs(output_dir)
+        assert len(outputs[1]) == 4
+        assert outputs[1] == outputs[2]
+
+    def test_incremental_conversion(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        output_dir = str(tmp_path / 'output') + '/'
+        Converter2vertical(corpus, output_dir, incremental=True).iterate_through_corpus()
+        first_run = self.read_outputs(output_dir)
+
+        with open(corpus + 'reviewed_articles/a2/sub-articles/a2.s1.txt', 'w') as changed_file:
+            changed_file.write('Changed text.')
+        os.remove(corpus + 'reviewed_articles/a1/sub-articles/a1.r1.xml')
+        converter = Converter2vertical(corpus, output_dir, incremental=True)
+        converter.iterate_through_corpus()
+        second_run = self.read_outputs(output_dir)
+
+        assert set(converter.manifest.entries) == set(second_run)
+        assert 'reviewed_articles/a1/sub-articles/a1.r1.txt' not in second_run
+        assert second_run['reviewed_articles/a2/sub-articles/a2.r1.txt'] == \
+               first_run['reviewed_articles/a2/sub-articles/a2.r1.txt']
+        assert 'Changed' in second_run['reviewed_articles/a2/sub-articles/a2.s1.txt']
+
+        # Adding a column changes every output.
+        converter = Converter2vertical(corpus, output_dir, incremental=True, columns=[lowercase_column])
+        converter.iterate_through_corpus()
+        assert 'Tove\ttove\n' in self.read_outputs(output_dir)['reviewed_articles/a2/sub-articles/a2.r1.txt']
+
+    def test_corpus_index(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        index = CorpusIndex.scan(corpus, self.converter.extensions)
+        assert [os.path.basename(entry.path) for entry in index.entries] == \
+               ['a1.r1.xml', 'a1.s1.txt', 'a2.r1.xml', 'a2.s1.txt']
+        supplement = index.entries[1]
+        assert supplement.supplement
+        assert supplement.metadata_path == corpus + 'reviewed_articles/a1/sub-articles/a1.r1.json'
+
+        index.save(str(tmp_path / 'index.json'))
+        assert CorpusIndex.load(str(tmp_path / 'index.json')).entries == index.entries
+
+    def test_metadata_store(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        json_path = corpus + 'reviewed_articles/a1/sub-articles/a1.r1.json'
+        store = MetadataStore()
+        rendered = []
+
+        def render(data):
+            rendered.append(data)
+            return data['title']
+
+        assert store.render(json_path, render) == 'Test title'
+        assert store.render(json_path, render) == 'Test title'
+        assert len(rendered) == 1
+        assert store.load(json_path) is rendered[0]
+        with pytest.raises(FileNotFoundError):
+            store.load(corpus + 'reviewed_articles/a1/sub-articles/missing.json')
+
+        # The JSON files are read without holding the lock of the store, which threads share.
+        load_directory = store.load_directory
+        store.load_directory = lambda directory: None if store.lock.locked() else load_directory(directory)
+        with ThreadPoolExecutor(2) as executor:
+            titles = list(executor.map(lambda article: store.render(
+                corpus + f'reviewed_articles/{article}/sub-articles/{article}.r1.json', render), ['a2', 'a2', 'a1']))
+        assert titles == ['Test title'] * 3
+
+    def test_fused_conversion(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        output_dir = str(tmp_path / 'output') + '/'
+        converter = Converter2vertical(corpus, output_dir, fused=True)
+        converter.iterate_through_corpus()
+        outputs = self.read_outputs(output_dir)
+
+        assert sorted(outputs) == ['reviewed_articles/a1/sub-articles/a1.r1.txt',
+                                   'reviewed_articles/a2/sub-articles/a2.r1.txt']
+        # Spawn and forkserver workers receive the converter pickled.
+        copy = pickle.loads(pickle.dumps(converter))
+        assert copy.doc_attributes(converter.index.entries[0]) == converter.doc_attributes(converter.index.entries[0])
+        document = outputs['reviewed_articles/a1/sub-articles/a1.r1.txt']
+        assert document.startswith('<doc author="Test, Name" title="Test title" journal="Test journal" '
+                                   'year="2030" doi="10.5555/12345678">\n')
+        assert document.endswith('\n!\n</doc>')
+
+    def test_extraction_cache(self, tmp_path):
+        cache = ExtractionCache(str(tmp_path / 'cache'), max_bytes=1000)
+        assert cache.get('ab' * 32, 'pdf2txt', '1') is None
+        cache.put('ab' * 32, 'pdf2txt', '1', 'Extracted\r\ntext')
+        assert cache.get('ab' * 32, 'pdf2txt', '1') == 'Extracted\r\ntext'
+        assert cache.get('ab' * 32, 'pdf2txt', '2') is None
+
+        # Incompressible texts overflow the cache and evict the oldest ones.
+        for number in range(10):
+            cache.put(f'{number:064d}', 'pdf2txt', '1', os.urandom(200).hex())
+        assert cache.disk_usage() <= 1000
+        assert cache.get(f'{9:064d}', 'pdf2txt', '1') is not None
+
+    def test_supervised_conversion(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        output_dir = str(tmp_path / 'output') + '/'
+        converter = Converter2vertical(corpus, output_dir, workers=2, incremental=True, timeout=1, retries=1)
+        converter.extensions_dict['.txt'] = hang
+        converter.iterate_through_corpus()
+
+        assert sorted(os.path.basename(path) for path in converter.quarantine) == ['a1.s1.txt', 'a2.s1.txt']
+        assert sorted(os.path.basename(path) for path in self.read_outputs(output_dir)) == ['a1.r1.txt', 'a2.r1.txt']
+        assert not glob.glob(output_dir + '**/*.part', recursive=True)
+
+        # Quarantined files are not converted again until they change.
+        converter = Converter2vertical(corpus, output_dir, incremental=True, timeout=1)
+        converter.extensions_dict['.txt'] = hang
+        converter.iterate_through_corpus()
+        assert len(converter.quarantine) == 2
+
+    def test_memory_limit(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        output_dir = str(tmp_path / 'output') + '/'
+        # The txt files are the same: the copy of the converted one is quarantined with it.
+        converter = Converter2vertical(corpus, output_dir, incremental=True, memory_limit=1024 ** 3, dedup=True)
+        converter.extensions_dict['.txt'] = allocate
+        converter.iterate_through_corpus()
+
+        assert sorted(os.path.basename(path) for path in converter.quarantine) == ['a1.s1.txt', 'a2.s1.txt']
+        assert all('Memory limit' in entry['reason'] for entry in converter.quarantine.values())
+        assert sorted(os.path.basename(path) for path in self.read_outputs(output_dir)) == ['a1.r1.txt', 'a2.r1.txt']
+
+    def test_run_report(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        report = RunReport(slowest=3)
+        converter = Converter2vertical(corpus, str(tmp_path / 'output') + '/', workers=2, report=report)
+        converter.iterate_through_corpus()
+
+        data = report.to_dict()
+        assert data['counters']['files'] == 4
+        assert data['extensions']['.xml']['files'] == 2
+        assert sum(data['extensions']['.txt']['histogram'].values()) == 2
+        assert {'scan', 'metadata', 'extract', 'write'} <= set(data['stages'])
+        assert len(data['slowest']) == 3
+        report.save_json(str(tmp_path / 'report.json'))
+        report.save_csv(str(tmp_path / 'report.csv'))
+        assert os.path.exists(str(tmp_path / 'report.csv'))
+
+    def test_async_conversion(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        Converter2vertical(corpus, str(tmp_path / 'sequential') + '/').iterate_through_corpus()
+        converter = Converter2vertical(corpus, str(tmp_path / 'async') + '/', workers=2)
+        AsyncConverter(converter, prefetch=2, writers=2, write_queue=1).run()
+
+        assert converter.failures == {}
+        assert self.read_outputs(str(tmp_path / 'async') + '/') == \
+               self.read_outputs(str(tmp_path / 'sequential') + '/')
+
+        # The xml files are converted from their path, the txt files are read ahead one at a time.
+        converter = Converter2vertical(corpus, str(tmp_path / 'large') + '/', workers=2, incremental=True)
+        AsyncConverter(converter, prefetch_bytes=1, large_file=100).run()
+        assert converter.failures == {}
+        assert self.read_outputs(str(tmp_path / 'large') + '/') == \
+               self.read_outputs(str(tmp_path / 'sequential') + '/')
+        assert set(converter.manifest.entries) == set(self.read_outputs(str(tmp_path / 'large') + '/'))
+
+    def test_sharded_output(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        Converter2vertical(corpus, str(tmp_path / 'files') + '/').iterate_through_corpus()
+        expected = self.read_outputs(str(tmp_path / 'files') + '/')
+        shard_dir = str(tmp_path / 'shards') + '/'
+        converter = Converter2vertical(corpus, shard_dir, workers=2, shard_size=100, shard_compression='gz')
+        converter.iterate_through_corpus()
+        converter.close()
+
+        reader = ShardReader(shard_dir)
+        assert sorted(reader.ids()) == sorted(expected)
+        assert all(reader.get(doc_id) == expected[doc_id] for doc_id in expected)
+        shards = sorted(glob.glob(shard_dir + '*.vert.gz'))
+        assert len(shards) > 1
+        # A shard is still an ordinary gzip file of its documents.
+        with gzip.open(shards[0], 'rt', encoding='utf-8') as shard_file:
+            assert shard_file.read() == ''.join(reader.get(doc_id) + '\n' for doc_id in reader.ids()
+                                                if reader.index[doc_id][0] == os.path.basename(shards[0]))
+
+        # Each document is followed by a newline, so that every tag is on its own line.
+        fused_dir = str(tmp_path / 'fused') + '/'
+        converter = Converter2vertical(corpus, fused_dir, workers=2, fused=True, shard_size=1024 ** 2)
+        converter.iterate_through_corpus()
+        converter.close()
+        with open(fused_dir + 'corpus-00000.vert', 'r', encoding='utf-8') as shard_file:
+            lines = shard_file.read().split('\n')
+        assert lines[-1] == ''
+        assert len([line for line in lines if line.startswith('<doc ')]) == 2
+        assert [line for line in lines if '<doc' in line or '</doc>' in line] == \
+               [line for line in lines if line.startswith('<doc ') or line.strip() == '</doc>']
+        assert len(ShardReader(fused_dir).ids()) == 2
+
+    def test_tokenizer(self, tmp_path):
+        texts = ['Hello, world! p-value < 0.05; under_score', 'Ünïcode — text\x1cwith\u2003spaces', '', ' \x1f ']
+        tokenizer = Tokenizer()
+        assert tokenizer.tokenize_many(texts) == [TOKEN_PATTERN.findall(text) for text in texts]
+        batches = tokenizer.iter_token_batches(' '.join(texts * 50), chunk_size=7)
+        assert [token for batch in batches for token in batch] == TOKEN_PATTERN.findall(' '.join(texts * 50))
+        # Without whitespace, only the token reaching the end of a chunk is carried over.
+        for text in ['a,' * 500000, 'x' * 1000000]:
+            start = time.perf_counter()
+            batches = list(tokenizer.iter_token_batches(text, chunk_size=1000))
+            assert time.perf_counter() - start < 5
+            assert [token for batch in batches for token in batch] == TOKEN_PATTERN.findall(text)
+
+        vertical = io.StringIO()
+        tokenizer.write_vertical(texts[0], vertical)
+        annotated = io.StringIO()
+        Tokenizer([lowercase_column]).annotate_vertical(io.StringIO('<doc title="T">\n' + vertical.getvalue()),
+                                                        annotated)
+        expected = io.StringIO()
+        Tokenizer([lowercase_column]).write_vertical(texts[0], expected)
+        assert annotated.getvalue() == '<doc title="T">\n' + expected.getvalue()
+        assert 'Hello\thello\n' in annotated.getvalue()
+
+        # The outputs of the converter, whose "doc" element is on the line of the first token.
+        corpus = self.build_corpus(tmp_path)
+        Converter2vertical(corpus, str(tmp_path / 'plain') + '/').iterate_through_corpus()
+        Converter2vertical(corpus, str(tmp_path / 'columns') + '/', columns=[lowercase_column]).iterate_through_corpus()
+        expected = self.read_outputs(str(tmp_path / 'columns') + '/')
+        for name, document in self.read_outputs(str(tmp_path / 'plain') + '/').items():
+            annotated = io.StringIO()
+            Tokenizer([lowercase_column]).annotate_vertical(io.StringIO(document), annotated)
+            assert annotated.getvalue() == expected[name]
+        assert '/>Tove\ttove\n' in expected['reviewed_articles/a1/sub-articles/a1.r1.txt']
+
+    def test_startup(self):
+        code = ('import sys, time\n'
+                'start = time.perf_counter()\n'
+                'import functions2txt\n'
+                'print(time.perf_counter() - start)\n'
+                'print(sorted({name.split(".")[0] for name in sys.modules} & {"aspose", "pdfminer", "docx2txt"}))')
+        output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.splitlines()
+        assert output[1] == '[]'
+        assert float(output[0]) < STARTUP_TARGET
+
+    def test_work_queue(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        Converter2vertical(corpus, str(tmp_path / 'sequential') + '/').iterate_through_corpus()
+        output_dir = str(tmp_path / 'output') + '/'
+        database = str(tmp_path / 'queue.sqlite')
+        queue = WorkQueue(database, lease_seconds=1)
+        assert Converter2vertical(corpus, output_dir, work_queue=queue).enqueue() == 2
+        assert Converter2vertical(corpus, output_dir, work_queue=queue).enqueue() == 0
+
+        # A worker that died holding a lease: its article is claimed again once the lease expires.
+        job_id, jobs = queue.claim('dead-worker', corpus)
+        assert [job.article for job in jobs] == ['a1', 'a1']
+        workers = [multiprocessing.Process(target=queue_worker, args=(corpus, output_dir, database))
+                   for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+
+        assert queue.counts() == {'done': 2}
+        assert queue.failures() == {}
+        assert not queue.complete(job_id, 'dead-worker', {})
+        assert self.read_outputs(output_dir) == self.read_outputs(str(tmp_path / 'sequential') + '/')
+
+        # Running the coordinator again queues the new articles and keeps the outputs of the done ones.
+        shutil.copytree(corpus + 'reviewed_articles/a1', corpus + 'reviewed_articles/a3')
+        assert Converter2vertical(corpus, output_dir, work_queue=queue).enqueue() == 1
+        assert self.read_outputs(output_dir) == self.read_outputs(str(tmp_path / 'sequential') + '/')
+        queue_worker(corpus, output_dir, database)
+        assert queue.counts() == {'done': 3}
+        Converter2vertical(corpus, str(tmp_path / 'sequential') + '/').iterate_through_corpus()
+        assert self.read_outputs(output_dir) == self.read_outputs(str(tmp_path / 'sequential') + '/')
+        with pytest.raises(ValueError):
+            Converter2vertical(corpus, str(tmp_path / 'other') + '/').enqueue()
+
+        # The worker processes of a queue worker are kept from one article to the next.
+        queue = WorkQueue(str(tmp_path / 'pids.sqlite'))
+        pids_dir = str(tmp_path / 'pids') + '/'
+        Converter2vertical(corpus, pids_dir, work_queue=queue).enqueue()
+        converter = Converter2vertical(corpus, pids_dir, workers=2, work_queue=queue)
+        converter.extensions_dict['.txt'] = process_id
+        assert converter.work() == 3
+        pids = {token for document in self.read_outputs(pids_dir).values() for token in TOKEN_PATTERN.findall(document)
+                if token.startswith('pid')}
+        assert 1 <= len(pids) <= 2
+
+    def test_inventory(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        with open(corpus + 'reviewed_articles/a2/metadata.json', 'w') as metadata_file:
+            metadata_file.write('{"journal": "Article journal", "volume": 3}')
+        shutil.copy(os.path.join(self.input_dir, 'dummy.txt'), corpus + 'reviewed_articles/a2/sub-articles/a2.s2.txt')
+
+        inventory = build_inventory(corpus, workers=2)
+        assert inventory['articles_count'] == 2
+        assert inventory['extensions']['.txt']['files'] == 3
+        assert inventory['extensions']['.json']['files'] == 3
+        assert inventory['journals']['Test journal'] == {'articles': 1, 'files': 3,
+                                                         'bytes': inventory['articles']['a1']['bytes']}
+        assert inventory['articles']['a2']['journal'] == 'Article journal'
+        assert inventory['article_metadata_keys'] == {'journal': 1, 'volume': 1}
+        assert inventory['schema_variants'] == [{'keys': ['author', 'doi', 'journal', 'title', 'year'], 'files': 2}]
+        assert largest_first(inventory) == ['a2', 'a1']
+        save_inventory(inventory, str(tmp_path / 'inventory.json'))
+        assert load_inventory(str(tmp_path / 'inventory.json')) == inventory
+
+    def test_scheduler(self, tmp_path, monkeypatch):
+        scheduler = Scheduler()
+        assert scheduler.assign([5, 4, 3, 3, 3], 2) == [[0, 3], [1, 2, 4]]
+        assert scheduler.predict_makespan([5, 4, 3, 3, 3], 2) == 10
+
+        corpus = self.build_corpus(tmp_path)
+        Converter2vertical(corpus, str(tmp_path / 'sequential') + '/').iterate_through_corpus()
+        report = RunReport()
+        converter = Converter2vertical(corpus, str(tmp_path / 'scheduled') + '/', workers=2, report=report,
+                                       scheduler=scheduler)
+        converter.iterate_through_corpus()
+        assert self.read_outputs(str(tmp_path / 'scheduled') + '/') == \
+               self.read_outputs(str(tmp_path / 'sequential') + '/')
+        assert set(report.to_dict()['schedule']) == {'predicted_makespan', 'actual_makespan', 'balance'}
+
+        # The measured throughput is averaged with the previous estimate.
+        scheduler.observe('.pdf', 10 ** 7, 10.002)
+        scheduler.record_run(1, 1, 1)
+        assert scheduler.throughput['.pdf'] == pytest.approx(0.75e6)
+
+        scheduler.save(str(tmp_path / 'throughput.json'))
+        assert Scheduler.load(str(tmp_path / 'throughput.json')).throughput == scheduler.throughput
+        jobs, costs = scheduler.order(converter.index.entries)
+        assert costs == sorted(costs, reverse=True)
+
+        # With an inventory, the file sizes are not read again.
+        inventory = build_inventory(corpus, workers=2)
+        monkeypatch.setattr(os.path, 'getsize', None)
+        inventory_scheduler = Scheduler(scheduler.throughput, inventory=inventory)
+        assert inventory_scheduler.order(converter.index.entries) == (jobs, costs)
+
+    def test_deduplication(self, tmp_path):
+        # The two articles of the corpus have the same xml and txt files.
+        corpus = self.build_corpus(tmp_path)
+        with open(corpus + 'reviewed_articles/a2/sub-articles/a2.r1.json', 'w') as metadata_file:
+            metadata_file.write('{"title": "Other title"}')
+        Converter2vertical(corpus, str(tmp_path / 'sequential') + '/').iterate_through_corpus()
+        report = RunReport()
+        converter = Converter2vertical(corpus, str(tmp_path / 'dedup') + '/', workers=2, incremental=True,
+                                       dedup=True, report=report)
+        converter.iterate_through_corpus()
+
+        outputs = self.read_outputs(str(tmp_path / 'dedup') + '/')
+        assert outputs == self.read_outputs(str(tmp_path / 'sequential') + '/')
+        assert 'Other title' in outputs['reviewed_articles/a2/sub-articles/a2.r1.txt']
+        assert report.counters['files'] == 2
+        assert report.counters['deduplicated'] == 2
+        assert set(converter.manifest.entries) == set(outputs)
+
+        report = RunReport()
+        converter = Converter2vertical(corpus, str(tmp_path / 'async') + '/', workers=2, dedup=True, report=report)
+        AsyncConverter(converter).run()
+        assert self.read_outputs(str(tmp_path / 'async') + '/') == outputs
+        assert report.counters['deduplicated'] == 2
+        with pytest.raises(ValueError):
+            AsyncConverter(Converter2vertical(corpus, str(tmp_path / 'async') + '/', timeout=10))
+
+    def test_add_metadata_high_throughput(self, tmp_path):
+        corpus = self.build_corpus(tmp_path)
+        for article in ('a1', 'a2'):
+            shutil.copy(os.path.join(self.input_dir, 'dummy.txt'),
+                        corpus + f'reviewed_articles/{article}/sub-articles/{article}.r1.txt')
+        with open(corpus + 'reviewed_articles/a2/sub-articles/a2.r2.txt', 'wb') as undecodable_file:
+            undecodable_file.write(b'Not \xff UTF-8')
+        AddMetadata(corpus, str(tmp_path / 'plain')).process_articles()
+        AddMetadata(corpus, str(tmp_path / 'fast'), high_throughput=True, threads=2).process_articles()
+        AddMetadata(corpus, str(tmp_path / 'indexed')).process_articles(index=CorpusIndex.scan(corpus, ['.txt']))
+
+        outputs = self.read_outputs(str(tmp_path / 'fast') + '/')
+        assert outputs == self.read_outputs(str(tmp_path / 'plain') + '/')
+        assert outputs == self.read_outputs(str(tmp_path / 'indexed') + '/')
+        assert sorted(outputs) == ['reviewed_articles/a1/sub-articles/a1.r1.txt',
+                                   'reviewed_articles/a2/sub-articles/a2.r1.txt']
+        assert not glob.glob(str(tmp_path / 'fast') + '/**/*.part', recursive=True)
+
+    def test_render_sgml(self):
+        documents = [{'author': 'Test, Name', 'title': 'A <b> & "c"\n', 'year': 2030},
+                     {'authors': [{'name': 'X', 'affiliations': ['u1', 'u2']}, {'name': 'Y'}], 'empty': []},
+                     {'keywords': ['a', ['b', {'nested': None}], 3], 'text': ''},
+                     [], 'plain text', 0]
+        for document in documents:
+            root = ET.Element('doc')
+            json_to_sgml(document, root)
+            assert render_sgml(document) == ET.tostring(root, encoding='unicode')
+        assert render_sgml_many(documents) == [render_sgml(document) for document in documents]
@@ -45,26 +45,24 @@ def flat_builder():
 
 
 def json_explorer(inpath):
-    journal_metadata = []
-    file_metadata = []
+    # Dicts keep the keys in order of appearance, with constant-time membership checks.
+    # For the full statistics of a corpus, see inventory.py.
+    journal_metadata = {}
+    file_metadata = {}
     for directory in os.listdir(inpath):
-        print(file_metadata)
+        print(list(file_metadata))
         if os.path.isfile(inpath + directory + '/metadata.json'):
-            metadata_keys = json.load(open(inpath + directory + '/metadata.json')).keys()
-            for key in metadata_keys:
-                if key not in journal_metadata:
-                    journal_metadata.append(key)
+            with open(inpath + directory + '/metadata.json') as file:
+                journal_metadata.update(dict.fromkeys(json.load(file).keys()))
 
             if os.path.isdir(inpath + directory + '/sub-articles'):
                 for file_path in os.listdir(inpath + directory + '/sub-articles'):
                     if file_path.split('.')[-1] == 'json':
                         with open(inpath + directory + '/sub-articles/' + file_path) as file:
-                            metadata_keys = json.load(file).keys()
-                            for key in metadata_keys:
-                                if key not in file_metadata:
-                                    file_metadata.append(key)
-    print(journal_metadata)
-    print(file_metadata)
+                            file_metadata.update(dict.fromkeys(json.load(file).keys()))
+    print(list(journal_metadata))
+    print(list(file_metadata))
+    return list(journal_metadata), list(file_metadata)
 
 
 if __name__ == "__main__":
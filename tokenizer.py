@@ -0,0 +1,228 @@
+import re
+
+# A token is a run of word characters or a run of other non-space characters.
+TOKEN_PATTERN = re.compile(r'\w+|[^\s\w]+')
+# Number of characters tokenized at a time by the streaming writer.
+CHUNK_SIZE = 1 << 16
+# Number of lines of a vertical file annotated at a time.
+ANNOTATION_BATCH = 4096
+# Tokens never mix word and other characters, so a line with both "<" and a word character is markup.
+MARKUP_PATTERN = re.compile(r'<.*\w|\w.*<')
+# A tag followed by the first token on the same line, as after the "doc" element of the
+# non-fused documents. Attribute values never contain ">", which render_sgml escapes.
+LEADING_TAG = re.compile(r'(<[^<>\t]*\w[^<>\t]*>)(.+)')
+
+
+def lowercase_column(tokens):
+    """
+    A column of the vertical format: the lowercase form of each token.
+
+    Columns are functions receiving a list of tokens and returning one value per token, so that
+    a tagger or lemmatizer can process a whole batch at once.
+
+    Args:
+        tokens (list): The tokens.
+
+    Returns:
+        list: The lowercase tokens.
+    """
+    return [token.lower() for token in tokens]
+
+
+def rechunk(pieces, chunk_size):
+    """
+    Joins pieces of text into chunks of at least chunk_size characters, except the last one.
+
+    Args:
+        pieces (iterator): The pieces of text, of any size.
+        chunk_size (int): The minimum size of the chunks.
+
+    Returns:
+        generator: The chunks.
+    """
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+class Tokenizer:
+    def __init__(self, columns=None, chunk_size=CHUNK_SIZE):
+        """
+        Splits texts into the tokens of the vertical format, with optional extra columns.
+
+        Args:
+            columns (list): The functions computing the columns written after the token, e.g.
+                lowercase_column. By default, only the tokens are written.
+            chunk_size (int): The number of characters tokenized at a time when streaming.
+
+        Returns:
+            None
+        """
+        self.columns = list(columns or [])
+        self.chunk_size = chunk_size
+
+    def tokenize(self, text, start=0, end=None):
+        """
+        Returns the tokens of a text, or of a slice of it.
+
+        Args:
+            text (str): The text.
+            start (int): The index where the tokenization starts.
+            end (int): The index where the tokenization stops. By default, the end of the text.
+
+        Returns:
+            list: The tokens.
+        """
+        if end is None:
+            end = len(text)
+        return TOKEN_PATTERN.findall(text, start, end)
+
+    def tokenize_many(self, texts):
+        """
+        Returns the tokens of each text.
+
+        Args:
+            texts (iterable): The texts.
+
+        Returns:
+            list: The list of tokens of each text.
+        """
+        return [self.tokenize(text) for text in texts]
+
+    def iter_token_batches(self, text, chunk_size=None):
+        """
+        Tokenizes a text chunk by chunk, without holding all its tokens.
+
+        Only the last token of a chunk may continue in the next one, when it reaches the end of
+        the chunk: it is carried over and completed with the characters of the same kind that
+        start the next chunk, so that a text without whitespace is still read in linear time.
+
+        Args:
+            text (str, file or iterator): The text, a text file object to read it from, or an
+                iterator of pieces of text, such as the streaming extractors return.
+            chunk_size (int): The number of characters read at a time. By default, the chunk size
+                of the tokenizer.
+
+        Returns:
+            generator: Lists of tokens, in the order of the text.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        if hasattr(text, 'read'):
+            chunks = iter(lambda: text.read(chunk_size), '')
+        elif hasattr(text, '__next__'):
+            chunks = rechunk(text, chunk_size)
+        else:
+            if type(text) != str:
+                text = str(text)
+            chunks = (text[start:start + chunk_size] for start in range(0, len(text), chunk_size))
+        # The pieces of the token carried over, joined once it ends.
+        carry = []
+        for chunk in chunks:
+            start = 0
+            if carry:
+                # The token matched from the last carried character tells how far the chunk continues it.
+                start = TOKEN_PATTERN.match(carry[-1][-1] + chunk).end() - 1
+                if start == len(chunk):
+                    carry.append(chunk)
+                    continue
+                if start:
+                    carry.append(chunk[:start])
+            tokens = self.tokenize(chunk, start)
+            if carry:
+                tokens.insert(0, ''.join(carry))
+                carry = []
+            # Every character but whitespace is in a token, so the last token reaches the end of
+            # the chunk exactly when the chunk ends with it.
+            if tokens and chunk.endswith(tokens[-1]):
+                carry.append(tokens.pop())
+            if tokens:
+                yield tokens
+        if carry:
+            yield [''.join(carry)]
+
+    def vertical_lines(self, tokens):
+        """
+        Returns the lines of the vertical format of tokens: the token and its columns, separated by tabs.
+
+        Args:
+            tokens (list): The tokens.
+
+        Returns:
+            list: The lines, without newlines.
+        """
+        if not self.columns:
+            return tokens
+        values = [column(tokens) for column in self.columns]
+        return ['\t'.join(line) for line in zip(tokens, *values)]
+
+    def write_vertical(self, text, outfile, chunk_size=None, closing=' </doc>'):
+        """
+        Writes the vertical form of a text to a file.
+
+        Args:
+            text (str, file or iterator): The text, a text file object or an iterator of pieces of text.
+            outfile (file): The text file object to write to.
+            chunk_size (int): The number of characters tokenized at a time.
+            closing (str): The line written after the tokens.
+
+        Returns:
+            None
+        """
+        empty = True
+        for tokens in self.iter_token_batches(text, chunk_size):
+            outfile.write('\n'.join(self.vertical_lines(tokens)))
+            outfile.write('\n')
+            empty = False
+        # An empty text still gets the newline of the joined tokens.
+        outfile.write(closing if not empty else '\n' + closing)
+
+    def annotate_vertical(self, infile, outfile, batch_size=ANNOTATION_BATCH):
+        """
+        Adds the columns of the tokenizer to an existing vertical file, without tokenizing it again.
+
+        The columns are computed from the first column of each token line and appended to its
+        existing columns. Markup lines, such as the "doc" elements, are copied as they are, and
+        a tag starting the line of a token is copied before the columns of the token.
+
+        Args:
+            infile (file): The text file object of the vertical file.
+            outfile (file): The text file object to write to.
+            batch_size (int): The number of lines annotated at a time.
+
+        Returns:
+            None
+        """
+        batch = []
+
+        def flush():
+            tokens = [line.split('\t', 1)[0] for line, ending in batch]
+            values = [column(tokens) for column in self.columns]
+            for (line, ending), *line_values in zip(batch, *values):
+                outfile.write('\t'.join([line] + line_values) + ending)
+            batch.clear()
+
+        for line in infile:
+            # The last line may have no newline, as the closing "</doc>" written by write_vertical.
+            ending = '\n' if line.endswith('\n') else ''
+            line = line[:len(line) - len(ending)]
+            tag = LEADING_TAG.match(line)
+            if tag is not None:
+                flush()
+                outfile.write(tag.group(1))
+                line = tag.group(2)
+            if not line or MARKUP_PATTERN.search(line.split('\t', 1)[0]):
+                flush()
+                outfile.write(line + ending)
+            else:
+                batch.append((line, ending))
+                if len(batch) >= batch_size:
+                    flush()
+        flush()
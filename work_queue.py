@@ -0,0 +1,227 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from corpus_index import CorpusEntry
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    article TEXT UNIQUE NOT NULL,
+    entries TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT
+)'''
+
+
+def worker_name():
+    # Unique across the hosts sharing the queue and the processes of a host.
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class WorkQueue:
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        """
+        A queue of per-article conversion jobs in an SQLite database, shared by workers on any number of hosts.
+
+        A worker claims a job with a lease and renews it with heartbeats while converting. A job
+        whose lease expired, because its worker died or lost the database, is claimed again by
+        another worker. Every change is a single transaction, so a job is only marked done by
+        the worker that still holds its lease.
+
+        The database can live on a shared file system that supports POSIX locks; the hosts'
+        clocks are assumed to agree to well within the lease duration.
+
+        Args:
+            path (str): The path of the database.
+            lease_seconds (float): How long a claimed job stays reserved without heartbeat.
+            max_attempts (int): How many times a job is claimed before it is marked failed.
+
+        Returns:
+            None
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with closing(self.connect()) as connection:
+            connection.execute(SCHEMA)
+
+    def connect(self):
+        # One connection per operation: the queue is used from heartbeat threads and pickled to workers.
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute('PRAGMA busy_timeout = 60000')
+        return connection
+
+    def transaction(self, connection):
+        # BEGIN IMMEDIATE takes the write lock at once, so two workers cannot claim the same job.
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    def enqueue(self, inpath, entries):
+        """
+        Adds one job per article; articles that are already queued are left as they are.
+
+        The paths are stored relative to the corpus, so that the hosts may mount it elsewhere.
+
+        Args:
+            inpath (str): The path to the corpus.
+            entries (list): The CorpusEntry of the files to convert.
+
+        Returns:
+            int: The number of new jobs.
+        """
+        articles = {}
+        for entry in entries:
+            articles.setdefault(entry.article, []).append(
+                [entry.path[len(inpath):], entry.extension,
+                 entry.metadata_path[len(inpath):] if entry.metadata_path is not None else None, entry.supplement])
+        with closing(self.connect()) as connection:
+            self.transaction(connection)
+            before = connection.total_changes
+            connection.executemany('INSERT OR IGNORE INTO jobs (article, entries) VALUES (?, ?)',
+                                   [(article, json.dumps(files)) for article, files in articles.items()])
+            added = connection.total_changes - before
+            connection.execute('COMMIT')
+        return added
+
+    def claim(self, owner, inpath):
+        """
+        Leases the next pending job, or a job whose lease expired.
+
+        Args:
+            owner (str): The name of the worker.
+            inpath (str): The path to the corpus on this host.
+
+        Returns:
+            tuple or None: The id of the job and the CorpusEntry of its files, or None if no job
+            can be claimed now.
+        """
+        now = time.time()
+        with closing(self.connect()) as connection:
+            self.transaction(connection)
+            # Jobs that used up their attempts are given up instead of being claimed again.
+            connection.execute("UPDATE jobs SET state = 'failed', owner = NULL, result = ? "
+                               "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                               (json.dumps({'error': 'Lease expired too many times'}), now, self.max_attempts))
+            row = connection.execute("SELECT id, article, entries FROM jobs WHERE state = 'pending' "
+                                     "OR (state = 'leased' AND lease_until < ?) ORDER BY id LIMIT 1",
+                                     (now,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE jobs SET state = 'leased', owner = ?, lease_until = ?, "
+                                   "attempts = attempts + 1 WHERE id = ?", (owner, now + self.lease_seconds, row[0]))
+            connection.execute('COMMIT')
+        if row is None:
+            return None
+        job_id, article, files = row
+        return job_id, [CorpusEntry(article, inpath + path, extension,
+                                    inpath + metadata_path if metadata_path is not None else None, supplement)
+                        for path, extension, metadata_path, supplement in json.loads(files)]
+
+    def heartbeat(self, job_id, owner):
+        """
+        Extends the lease of a job.
+
+        Returns:
+            bool: False if the worker lost the lease.
+        """
+        with closing(self.connect()) as connection:
+            cursor = connection.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? "
+                                        "AND state = 'leased'", (time.time() + self.lease_seconds, job_id, owner))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, owner, failures):
+        """
+        Marks a job done, with the files that failed to convert.
+
+        Args:
+            job_id (int): The id of the job.
+            owner (str): The name of the worker.
+            failures (dict): The error of each failed file, by path.
+
+        Returns:
+            bool: False if the lease had been lost, in which case the job is left to its new owner.
+        """
+        with closing(self.connect()) as connection:
+            cursor = connection.execute("UPDATE jobs SET state = 'done', lease_until = NULL, result = ? "
+                                        "WHERE id = ? AND owner = ? AND state = 'leased'",
+                                        (json.dumps({'failures': failures}), job_id, owner))
+            return cursor.rowcount == 1
+
+    def release(self, job_id, owner, error):
+        """
+        Gives a job back after an error of the worker, to be claimed again until max_attempts.
+
+        Returns:
+            bool: False if the lease had been lost.
+        """
+        with closing(self.connect()) as connection:
+            cursor = connection.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' "
+                                        "ELSE 'pending' END, owner = NULL, lease_until = NULL, result = ? "
+                                        "WHERE id = ? AND owner = ? AND state = 'leased'",
+                                        (self.max_attempts, json.dumps({'error': error}), job_id, owner))
+            return cursor.rowcount == 1
+
+    def counts(self):
+        """
+        Returns the number of jobs in each state.
+        """
+        with closing(self.connect()) as connection:
+            return dict(connection.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+    def failures(self):
+        """
+        Returns the failed files of the done jobs and the error of the failed jobs, by article.
+        """
+        with closing(self.connect()) as connection:
+            rows = connection.execute("SELECT article, result FROM jobs WHERE state IN ('done', 'failed')").fetchall()
+        failures = {}
+        for article, result in rows:
+            result = json.loads(result)
+            if result.get('error') or result.get('failures'):
+                failures[article] = result
+        return failures
+
+
+class Heartbeat:
+    def __init__(self, queue, job_id, owner):
+        """
+        Renews the lease of a job from a background thread, three times per lease duration.
+
+        Args:
+            queue (WorkQueue): The queue of the job.
+            job_id (int): The id of the job.
+            owner (str): The name of the worker.
+
+        Returns:
+            None
+        """
+        self.queue = queue
+        self.job_id = job_id
+        self.owner = owner
+        self.lost = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.owner):
+                    self.lost = True
+                    return
+            except sqlite3.Error as e:
+                # The next beat may get through before the lease expires.
+                print(f'Heartbeat of job {self.job_id} failed: {e}')
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()